@@ -0,0 +1,150 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+import importlib
+import bencode
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSIONS = ['.mkv', '.mp4', '.avi', '.flac', '.srt', '.nfo', '.jpg']
+PIECE_LENGTH = 256 * 1024
+
+def make_sparse_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as file_handle:
+        file_handle.truncate(size)
+
+def get_zero_pieces(total_size):
+    # Sparse files read back as zeros, so every full piece has the same hash
+    full_piece = hashlib.sha1(bytes(PIECE_LENGTH)).digest()
+    pieces_count, last_piece = divmod(total_size, PIECE_LENGTH)
+    pieces = full_piece * pieces_count
+    if last_piece:
+        pieces += hashlib.sha1(bytes(last_piece)).digest()
+    return pieces
+
+def generate(root, args):
+    random.seed(args.seed)
+    search_dir = os.path.join(root, 'library')
+    bt_backup = os.path.join(root, 'BT_backup')
+    os.makedirs(search_dir)
+    os.makedirs(bt_backup)
+    library = []
+    for index in range(args.files):
+        folders = ['dir' + str(random.randrange(args.width)) for x in range(random.randint(1, args.depth))]
+        extension = random.choice(EXTENSIONS)
+        size = random.randint(1, args.max_size) * 1024 + index
+        path = os.path.join(search_dir, *folders, 'file ' + str(index) + extension)
+        make_sparse_file(path, size)
+        library.append((path, size, extension))
+    hashes = []
+    for torrent_index in range(args.torrents):
+        files = random.sample(library, min(args.files_per_torrent, len(library)))
+        torrent_files = []
+        for file_index, (path, size, extension) in enumerate(files):
+            torrent_files.append({'length':size, 'path':['Season ' + str(file_index % 3), 'Episode ' + str(file_index) + extension]})
+            if random.random() < args.duplicate_ratio:
+                make_sparse_file(os.path.join(search_dir, 'duplicates', str(torrent_index), 'copy ' + str(file_index) + extension), size)
+        total_size = sum(x['length'] for x in torrent_files)
+        info = {'name':'Torrent ' + str(torrent_index), 'piece length':PIECE_LENGTH, 'pieces':get_zero_pieces(total_size), 'files':torrent_files}
+        hash = hashlib.sha1(bencode.encode(info)).hexdigest()
+        with open(os.path.join(bt_backup, hash + '.torrent'), 'wb') as file_handle:
+            file_handle.write(bencode.encode({'announce':'http://localhost/announce', 'info':info}))
+        with open(os.path.join(bt_backup, hash + '.fastresume'), 'wb') as file_handle:
+            file_handle.write(bencode.encode({'file-format':'libtorrent resume file', 'info-hash':bytes.fromhex(hash), 'pieces':bytes(len(info['pieces']) // 20), 'save_path':'/old', 'qBt-savePath':'/old', 'paused':0}))
+        hashes.append(hash)
+    return search_dir, bt_backup, hashes
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - started
+
+def load_v2():
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module('qbit_automatch')
+
+def run_v2(search_dir, bt_backup, hashes, timer):
+    v2 = load_v2()
+    with timer.stage('scan'):
+        search = v2.scan([search_dir])
+    with timer.stage('parse'):
+        torrents = [v2.parse_torrent(bt_backup, hash) for hash in hashes]
+    with timer.stage('find_matches'):
+        for torrent_files in torrents:
+            v2.match(search, torrent_files)
+    with timer.stage('resolve_multiple'):
+        for torrent_files in torrents:
+            v2.resolve(torrent_files, v2.TorrentFiles.FUZZY_AUTO)
+    with timer.stage('fastresume_write'):
+        v2.apply([v2.plan(torrent_files, bt_backup) for torrent_files in torrents])
+    search.close()
+
+def get_scan_memory(search_dir):
+    # (bytes still allocated by the scan result, peak bytes allocated while scanning), measured
+    # apart so tracing doesn't skew the timings
+    v2 = load_v2()
+    tracemalloc.start()
+    try:
+        search = v2.scan([search_dir])
+        search.sort_files()
+        return tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = REPO_DIR, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_input():
+    parser = argparse.ArgumentParser(description = 'Times every stage of qbit_automatch against a synthetic library of sparse files')
+    parser.add_argument('--files', metavar = 'N', type = int, default = 10000, help = 'Files in the synthetic library. Defaults to 10000')
+    parser.add_argument('--depth', metavar = 'N', type = int, default = 4, help = 'Maximum folder depth of the library. Defaults to 4')
+    parser.add_argument('--width', metavar = 'N', type = int, default = 10, help = 'Folder names to choose from at each level. Defaults to 10')
+    parser.add_argument('--max_size', metavar = 'KB', type = int, default = 4096, help = 'Maximum file size in KB. Defaults to 4096')
+    parser.add_argument('--torrents', metavar = 'N', type = int, default = 20, help = 'Torrents to generate. Defaults to 20')
+    parser.add_argument('--files_per_torrent', metavar = 'N', type = int, default = 50, help = 'Files in each torrent. Defaults to 50')
+    parser.add_argument('--duplicate_ratio', metavar = 'R', type = float, default = 0.1, help = 'Fraction of torrent files that get a same size copy in the library. Defaults to 0.1')
+    parser.add_argument('--seed', metavar = 'N', type = int, default = 0, help = 'Random seed. Defaults to 0')
+    parser.add_argument('--output', metavar = 'PATH', help = 'Write the JSON results to PATH instead of stdout')
+    return parser.parse_args()
+
+def main():
+    args = parse_input()
+    results = {'commit':get_commit(), 'python':platform.python_version(), 'platform':platform.platform(), 'params':vars(args), 'results':{}}
+    # qbit_automatch.py is a thin CLI over the same package, so only the package is timed.
+    # Results stay under 'v2' to compare with runs on older commits
+    with tempfile.TemporaryDirectory(prefix = 'qbit_automatch_bench') as root:
+        search_dir, bt_backup, hashes = generate(root, args)
+        timer = Timer()
+        run_v2(search_dir, bt_backup, hashes, timer)
+        files_count = sum(len(x[2]) for x in os.walk(search_dir))
+        scan_memory, scan_peak_memory = get_scan_memory(search_dir)
+        results['results']['v2'] = {'stages':timer.stages, 'total':sum(timer.stages.values()), 'files':files_count, 'scan_memory':scan_memory, 'scan_memory_per_file':scan_memory / max(files_count, 1), 'scan_peak_memory':scan_peak_memory, 'scan_peak_memory_per_file':scan_peak_memory / max(files_count, 1)}
+    print('v2: ' + ', '.join(name + ' ' + '{:.3f}'.format(elapsed) + 's' for name, elapsed in timer.stages.items()) + ', ' + '{:.0f}'.format(scan_memory / max(files_count, 1)) + ' bytes per file, ' + '{:.0f}'.format(scan_peak_memory / max(files_count, 1)) + ' peak', file = sys.stderr)
+    output = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            file_handle.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,199 +1,169 @@
 import argparse
 import os
-import collections
-import sys
-from shutil import copyfile
-from pathlib import Path
+from qbit_automatch import api
+from qbit_automatch.cli import check_python_version
+from qbit_automatch.core import TorrentFiles, TorrentResult, get_bt_backup_default, list_bt_backup_hashes, read_hashes_file
+from qbit_automatch.errors import QbitAutomatchError, UnmatchedFilesError, DuplicateMatchesError, CancelledError
 
-try:
-    import bencode
-except ModuleNotFoundError:
-    raise SystemExit('Error: The bencode.py module is needed, you can install it with this command: python -m pip install bencode.py')
+# The original CLI, kept with its arguments and output on top of the qbit_automatch package.
+# qbit_automatch_v2.py has every newer option
 
-try:
-    import psutil
-except ModuleNotFoundError:
-    raise SystemExit('Error: The psutil module is needed, you can install it with this command: python -m pip install psutil')
-
-try:
-    from rapidfuzz import process
-    from rapidfuzz.string_metric import levenshtein
-except ModuleNotFoundError:
-    raise SystemExit('Error: The rapidfuzz module is needed, you can install it with this command: python -m pip install rapidfuzz')
-
-def get_bt_backup_default():
-    if sys.platform == "win32":
-        return os.path.join(os.getenv('LOCALAPPDATA'), 'qBittorrent', 'BT_backup')
-    elif sys.platform == "linux":
-        return os.path.join(Path.home(), '.local', 'share', 'data', 'qBittorrent', 'BT_backup')
-    elif sys.platform == "darwin":
-        return os.path.join(Path.home(), 'Library', 'ApplicationSupport', 'qBittorrent', 'BT_backup')
-
-def check_process_running(processName):
-     #Iterate over the all the running process
-    for proc in psutil.process_iter():
-        try:
-            # Check if process name contains the given name string.
-            if processName.lower() in proc.name().lower():
-                return True
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return False;
+def get_hashes(args):
+    if args.hash:
+        return [args.hash]
+    if args.hashes_from:
+        return read_hashes_file(args.hashes_from)
+    return list_bt_backup_hashes(args.bt_backup)
 
 def yes_or_no(question):
     reply = str(input(question+' (y/n): ')).lower().strip()
-    if reply[0] == 'y':
+    if reply[:1] == 'y':
         return True
-    if reply[0] == 'n':
+    if reply[:1] == 'n':
         return False
-    else:
-        return yes_or_no(question)
-
-def cache_search_dir(search_dir):
-    search_dir_cache=[]
-    for root, subdirs, files in os.walk(search_dir):
-        for os_filename in files:
-            os_file_extension = os.path.splitext(os_filename)[1]
-            os_file_length=os.path.getsize(os.path.join(root, os_filename))
-            os_relpath=os.path.relpath(root, search_dir)
-            search_dir_cache.append({'absolute_path':os.path.join(search_dir, root, os_filename), 'extension':os_file_extension, 'length':os_file_length})
-    return search_dir_cache
-
-def find_file(search_dir_cache, file_length, file_extension, filename):
-    files=[]
-    for i in search_dir_cache:
-        if (file_length == i['length'] and
-            file_extension == i['extension']):
-            files.append(i['absolute_path'])
-    return files
-
-def update_fastresume(qBt_savePath, mapped_files):
-    #Fetch the fastresume file data
-    with open(fastresume_path, 'rb') as fd:
-        fastresume_data = bencode.decode(fd.read())
-    #update the root save path and files
-    fastresume_data_upd=fastresume_data.copy()
-    fastresume_data_upd['qBt-savePath']=qBt_savePath
-    fastresume_data_upd['save_path']=qBt_savePath
-    fastresume_data_upd['mapped_files']=mapped_files
-    fastresume_data_upd['paused']=1
-    if fastresume_data == fastresume_data_upd:
-        print('Info: Fastresume data matches already, no changes made')
-        exit(0)
-    if check_process_running('qbittorrent'):
-        raise SystemExit('Error: qBittorrent is running, close it first')
-    #backup the original fastresume file if bkp doesnt exists
-    if not os.path.isfile(fastresume_bkp_path):
-        copyfile(fastresume_path, fastresume_bkp_path)
-    #write the changed file to disk
-    with open(fastresume_path, 'wb') as fd:
-        fd.write(bencode.encode(fastresume_data_upd))
-
-parser=argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
-optional = parser._action_groups.pop()
-required = parser.add_argument_group('required arguments')
-parser._action_groups.append(optional)
-required.add_argument('-a', '--hash', help='Torrent hash. In qBittorrent right click the torrent -> copy -> hash', required=True)
-required.add_argument('-s', '--search_dir', metavar='PATH', help='Where to search for the files. Must be an absolute path', required=True)
-optional.add_argument('-b', '--bt_backup', metavar='PATH', default=get_bt_backup_default(), help='BT_backup location, defaults to:\nWindows: C:\\Users\\<username>\\AppData\\Local\\qBittorrent\\BT_backup\nLinux: /home/<username>/.local/share/data/qBittorrent/BT_backup\nOS X: /Users/<username/Library/ApplicationSupport/qBittorrent/BT_backup')
-optional.add_argument('-f', '--fix_duplicates', metavar='N', default=0, help='Values:\n0: throw an error when duplicates are found\n1: be prompted to choose files when duplicates are found\n2: use fuzzy string matching and choose files automatically\n3: use fuzzy string matching and choose files automatically but be prompted before proceeding\nDefaults to 0')
-optional.add_argument('-d', '--debug', action='store_true', help='Enable debug')
-args=parser.parse_args()
-
-#Validate input
-if not os.path.isdir(args.search_dir):
-    raise SystemExit('Error: ' + args.search_dir + ' is not a valid dir')
-
-if not os.path.isdir(args.bt_backup):
-    raise SystemExit('Error: ' + args.bt_backup + ' is not a valid dir. Try calling the script with --bt_backup parameter and the correct path')
-
-bt_backup=args.bt_backup
-torrent_path=os.path.join(bt_backup, args.hash + '.torrent')
-fastresume_path=os.path.join(bt_backup, args.hash + '.fastresume')
-fastresume_bkp_path=fastresume_path + '.bkp'
-
-if args.debug: print('hash..........: ' + args.hash)
-if args.debug: print('search_dir....: ' + args.search_dir)
-if args.debug: print('BT_backup.....: ' + bt_backup)
-if args.debug: print('torrent.......: ' + torrent_path)
-if args.debug: print('fastresume....: ' + fastresume_path)
-if args.debug: print('fastresume_bkp: ' + fastresume_bkp_path)
-
-#Cache the search_dir
-search_dir_cache=cache_search_dir(args.search_dir)
-
-#Parse torrent file and search the lenghts and extension in the search_dir
-searched_files=[]
-with open(torrent_path, 'rb') as fd:
-    torrent_data = bencode.decode(fd.read())
-    for td_file in torrent_data['info']['files']:
-        td_filename, td_file_extension = os.path.splitext(td_file['path'][-1])
-        td_file_length=int(td_file['length'])
-        result=find_file(search_dir_cache, td_file_length, td_file_extension, td_file['path'][-1])
-        searched_files.append({'searched':os.sep.join(td_file['path']), 'result':result})
-
-#Check if some files haven't been found
-not_found_abort=False
-for i in searched_files:
-    if not i['result']:
-        print('File not found: ' + i['searched'])
-        not_found_abort=True
-if not_found_abort:
-    raise SystemExit('Error: This is script only works if all files are accounted for within the search_dir')
-
-#Check if a file has duplicates
-duplicate_abort=False
-for i in searched_files:
-    if len(i['result']) > 1:
-        if args.fix_duplicates == '1':
-            print('File "' + i['searched'] + '" has the following duplicates. Input which is the correct one by entering the number:')
+    return yes_or_no(question)
+
+def resolve_duplicates(args, torrent_files):
+    duplicate_files=[x for x in torrent_files.files if x.get_matches_count() > 1]
+    if not duplicate_files:
+        return
+    if args.fix_duplicates in [TorrentFiles.FUZZY_AUTO, TorrentFiles.FUZZY_PROMPT]:
+        fuzzymatches, best_matches, verified = torrent_files.choose_matches(TorrentFiles.FUZZY_AUTO, strict = False)
+        best_matches=dict(zip([x.path for x in torrent_files.files], best_matches))
+    for i in duplicate_files:
+        if args.fix_duplicates == TorrentFiles.PROMPT:
+            print('File "' + i.path + '" has the following duplicates. Input which is the correct one by entering the number:')
         else:
-            print('File "' + i['searched'] + '" has the following duplicates:')
-        for idx, val in enumerate(i['result']):
-            print(' [' + str(idx) + '] ' + val)
-            duplicate_abort=True
-        if args.fix_duplicates in ['2','3']:
-            cache_result=process.extractOne(i['searched'], i['result'], scorer=levenshtein)[0]
-            i['result'] = []
-            i['result'].append(cache_result)
-            print('Fuzzy match: ' + cache_result)
-        elif args.fix_duplicates == '1':
+            print('File "' + i.path + '" has the following duplicates:')
+        for idx, val in enumerate(i.matches):
+            print(' [' + str(idx) + '] ' + val.path)
+        if args.fix_duplicates in [TorrentFiles.FUZZY_AUTO, TorrentFiles.FUZZY_PROMPT]:
+            i.set_single_match(next(x for x in i.matches if x.path == best_matches[i.path]))
+            print('Fuzzy match: ' + best_matches[i.path])
+        elif args.fix_duplicates == TorrentFiles.PROMPT:
             while True:
                 try:
-                    user_input=int(input("Enter your value: "))
-                    cache_result=i['result'][user_input]
-                    i['result'] = []
-                    i['result'].append(cache_result)
+                    i.set_single_match(i.matches[int(input("Enter your value: "))])
                     break
-                except (IndexError,TypeError,ValueError) as e:
+                except (IndexError,TypeError,ValueError):
                     pass
-if duplicate_abort and args.fix_duplicates not in ['1','2','3']:
-    raise SystemExit('Error: duplicates found. This happens when 2 files have the same length and extension. You can run the script with --fix_duplicates to fix them. Check the help for possible values')
-if duplicate_abort and args.fix_duplicates in ['3']:
-    if not yes_or_no('Continue?'):
-        exit(0)
-
-#extract the paths
-searched_paths=[]
-for i in searched_files:
-    searched_paths.append(i['result'][0])
-
-if len(searched_paths) != len(set(searched_paths)):
-    raise SystemExit('Error: There are duplicates in the values')
-
-print('All files matched')
-
-#Get the common path of all files and set the mapped_files as the relative path to the common path
-mapped_files=[]
-qBt_savePath=str(Path(os.path.commonpath(searched_paths)).parent)
-for file_path in searched_paths:
-    relpath=os.path.relpath(file_path, qBt_savePath)
-    mapped_files.append(relpath)
-
-if args.debug: print('qBt_savePath..: ' + qBt_savePath)
-
-#Updates qBittorrent fastresume file
-update_fastresume(qBt_savePath, mapped_files)
-
-print('Updated fastresume file')
-print('Done')
+    if args.fix_duplicates == TorrentFiles.THROW_ERROR:
+        raise SystemExit('Error: duplicates found. This happens when 2 files have the same length and extension. You can run the script with --fix_duplicates to fix them. Check the help for possible values')
+    if args.fix_duplicates == TorrentFiles.FUZZY_PROMPT and not yes_or_no('Continue?'):
+        raise CancelledError('Fuzzy matches not accepted')
+
+def match_torrent(args, torrent_files, search_dir, summary):
+    # Returns the FastresumeFile to write, None when it already has these paths
+    if args.debug: print('hash..........: ' + torrent_files.hash)
+    if args.debug: print('torrent.......: ' + torrent_files.torrent_path)
+    if args.debug: print('fastresume....: ' + os.path.join(args.bt_backup, torrent_files.hash + '.fastresume'))
+    try:
+        api.match(search_dir, torrent_files, summary)
+    except UnmatchedFilesError as e:
+        for path in e.paths:
+            print('File not found: ' + path)
+        raise SystemExit('Error: This is script only works if all files are accounted for within the search_dir')
+    resolve_duplicates(args, torrent_files)
+    try:
+        torrent_files.check_duplicates()
+    except DuplicateMatchesError:
+        raise SystemExit('Error: There are duplicates in the values')
+    print('All files matched')
+    fastresume_file = api.plan(torrent_files, args.bt_backup)
+    if args.debug: print('qBt_savePath..: ' + fastresume_file.save_path)
+    if fastresume_file.read_updated()[1] is None:
+        print('Info: Fastresume data matches already, no changes made')
+        summary.status='unchanged'
+        return None
+    return fastresume_file
+
+def main():
+    check_python_version()
+    parser=argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group('required arguments')
+    parser._action_groups.append(optional)
+    torrents = required.add_mutually_exclusive_group(required=True)
+    torrents.add_argument('-a', '--hash', help='Torrent hash. In qBittorrent right click the torrent -> copy -> hash')
+    torrents.add_argument('--all', action='store_true', help='Match every torrent in BT_backup against one scan of the search dir')
+    torrents.add_argument('--hashes_from', metavar='FILE', help='Match every torrent hash listed in FILE, one per line')
+    required.add_argument('-s', '--search_dir', metavar='PATH', help='Where to search for the files. Must be an absolute path', required=True)
+    optional.add_argument('-b', '--bt_backup', metavar='PATH', default=get_bt_backup_default(), help='BT_backup location, defaults to:\nWindows: C:\\Users\\<username>\\AppData\\Local\\qBittorrent\\BT_backup\nLinux: /home/<username>/.local/share/data/qBittorrent/BT_backup\nOS X: /Users/<username/Library/ApplicationSupport/qBittorrent/BT_backup')
+    optional.add_argument('-f', '--fix_duplicates', metavar='N', default=0, type=int, choices=range(0, 4), help='Values:\n0: throw an error when duplicates are found\n1: be prompted to choose files when duplicates are found\n2: use fuzzy string matching and choose files automatically\n3: use fuzzy string matching and choose files automatically but be prompted before proceeding\nDefaults to 0')
+    optional.add_argument('-d', '--debug', action='store_true', help='Enable debug')
+    args=parser.parse_args()
+
+    #Validate input
+    if not os.path.isdir(args.search_dir):
+        raise SystemExit('Error: ' + args.search_dir + ' is not a valid dir')
+
+    if not os.path.isdir(args.bt_backup):
+        raise SystemExit('Error: ' + args.bt_backup + ' is not a valid dir. Try calling the script with --bt_backup parameter and the correct path')
+
+    if args.hashes_from and not os.path.isfile(args.hashes_from):
+        raise SystemExit('Error: ' + args.hashes_from + ' is not a valid file')
+
+    if args.debug: print('search_dir....: ' + args.search_dir)
+    if args.debug: print('BT_backup.....: ' + args.bt_backup)
+
+    try:
+        summaries=[]
+        torrents=[]
+        for torrent_hash in get_hashes(args):
+            summary=TorrentResult(torrent_hash)
+            summaries.append(summary)
+            try:
+                torrents.append((api.parse_torrent(args.bt_backup, torrent_hash), summary))
+            except QbitAutomatchError as e:
+                if args.hash:
+                    raise
+                print('Error: ' + str(e))
+                summary.status='failed'
+        #Scan the search_dir once for every torrent
+        search_dir=api.scan([args.search_dir], [x[0] for x in torrents])
+        planned=[]
+        try:
+            for torrent_files, summary in torrents:
+                try:
+                    fastresume_file=match_torrent(args, torrent_files, search_dir, summary)
+                    if fastresume_file:
+                        planned.append((fastresume_file, summary))
+                except CancelledError:
+                    if args.hash:
+                        return
+                    summary.status='skipped'
+                except (SystemExit, OSError, QbitAutomatchError) as e:
+                    if args.hash:
+                        raise
+                    print(e.code if isinstance(e, SystemExit) else 'Error: ' + str(e))
+                    summary.status='failed'
+        finally:
+            search_dir.close()
+        #Every fastresume file is written by one journaled transaction after one process check
+        if planned:
+            try:
+                api.apply([x[0] for x in planned], results=[x[1] for x in planned])
+            except QbitAutomatchError as e:
+                if args.hash:
+                    raise
+                print('Error: ' + str(e))
+                for fastresume_file, summary in planned:
+                    summary.status='failed'
+            for fastresume_file, summary in planned:
+                if summary.status == 'updated':
+                    print('Updated fastresume file')
+                elif args.hash:
+                    raise SystemExit('Error: ' + str(summary.error))
+    except QbitAutomatchError as e:
+        raise SystemExit('Error: ' + str(e))
+    if not args.hash:
+        print('Summary:')
+        for summary in summaries:
+            print(' [' + summary.status + '] ' + summary.hash + ' ' + str(summary.name) + ': ' + str(summary.matched) + ' matched, ' + str(summary.ambiguous) + ' ambiguous, ' + str(summary.unmatched) + ' unmatched')
+        failed=len([x for x in summaries if x.failed()])
+        if failed:
+            raise SystemExit('Error: ' + str(failed) + ' of ' + str(len(summaries)) + ' torrents failed')
+    print('Done')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import importlib
+from .errors import QbitAutomatchError, MissingDependencyError, TorrentParseError, MatchError, UnmatchedFilesError, DuplicateMatchesError, CancelledError, UnsupportedTorrentError, ProcessRunningError, WriteError, JournalError, MaterializeError, WebApiError
+
+# Library API, the qbit_automatch_v2.py CLI is built on it:
+#   scan(search_dirs, torrents)          -> SearchDir of the files that can match
+#   parse_torrent(bt_backup, hash)       -> TorrentFiles
+#   match(search_dir, torrent_files)     -> TorrentResult, every file gets its candidates
+#   resolve(torrent_files, mode)         -> every file left with a single match
+#   plan(torrent_files, bt_backup)       -> FastresumeFile, nothing written yet
+#   apply(plans)                         -> TorrentResult per plan, one journaled write
+#   rollback(bt_backup)                  -> restores the latest journaled write
+# Every error is a QbitAutomatchError. numpy is imported with the first of these names,
+# rapidfuzz and psutil only when fuzzy matching or the qBittorrent process check needs them
+LAZY_ATTRIBUTES = {
+    'scan':'api', 'parse_torrent':'api', 'match':'api', 'resolve':'api', 'plan':'api', 'apply':'api', 'rollback':'api',
+    'TorrentFiles':'core', 'TorrentResult':'core', 'FastresumeFile':'core', 'SearchDir':'core', 'WebApiClient':'core', 'ReverseIndex':'core',
+}
+
+__all__ = list(LAZY_ATTRIBUTES) + ['QbitAutomatchError', 'MissingDependencyError', 'TorrentParseError', 'MatchError', 'UnmatchedFilesError', 'DuplicateMatchesError', 'CancelledError', 'UnsupportedTorrentError', 'ProcessRunningError', 'WriteError', 'JournalError', 'MaterializeError', 'WebApiError']
+
+def __getattr__(name):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+    value = getattr(importlib.import_module('.' + LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
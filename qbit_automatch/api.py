@@ -0,0 +1,109 @@
+import os
+from .core import TorrentFiles, TorrentResult, FastresumeFile, FastresumeWriter, LayoutMaterializer, SearchDir, PersistentIndex, FileFilter, get_journal_default
+from .errors import QbitAutomatchError, TorrentParseError, WriteError
+
+# The steps of the CLI as functions, each one raises a QbitAutomatchError subclass instead of
+# exiting. A whole run is:
+#   torrent_files = parse_torrent(bt_backup, hash)
+#   search_dir = scan(['/data'], [torrent_files])
+#   match(search_dir, torrent_files)
+#   resolve(torrent_files, TorrentFiles.FUZZY_AUTO)
+#   results = apply([plan(torrent_files, bt_backup)])
+
+def scan(search_dirs, torrents = None, include = None, exclude = None, max_depth = None, index = None, rescan = False, workers = 8, spill_to_disk = False):
+    # Returns the SearchDir of every file below search_dirs. With torrents only files with the
+    # size and extension of one of their files are kept. index is the path of a persistent
+    # index reused across calls, only changed directories are listed again
+    wanted = None if torrents is None else set((x.size, x.get_extension()) for torrent_files in torrents for x in torrent_files.files)
+    persistent_index = PersistentIndex(index, rescan) if index else None
+    try:
+        return SearchDir([os.path.abspath(x) for x in search_dirs], spill_to_disk, persistent_index, workers, FileFilter(wanted, include, exclude, max_depth))
+    finally:
+        if persistent_index:
+            persistent_index.close()
+
+def parse_torrent(bt_backup, hash, web_api = None):
+    # Returns the TorrentFiles of <hash>.torrent in bt_backup, or of the torrent loaded in
+    # qBittorrent when a logged in WebApiClient is given
+    try:
+        return TorrentFiles(bt_backup, hash, web_api)
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        raise TorrentParseError(hash, str(e))
+
+def match(search_dir, torrent_files, result = None):
+    # Finds the candidates of every file and returns the TorrentResult counting them, result is
+    # filled in when given. Raises UnmatchedFilesError, with the paths, when a file has none
+    torrent_files.find_matches(search_dir)
+    result = result or TorrentResult(torrent_files.hash)
+    result.count_matches(torrent_files)
+    torrent_files.check_unmatched()
+    return result
+
+def resolve(torrent_files, mode = TorrentFiles.FUZZY_AUTO):
+    # Leaves every file with a single match and returns the files, mode is a --fix_duplicates
+    # value. Raises DuplicateMatchesError when the candidates can't be told apart
+    torrent_files.resolve_multiple(mode)
+    torrent_files.check_duplicates()
+    return torrent_files.files
+
+def plan(torrent_files, bt_backup, verify = False, hash_workers = None, materialize = None, link_workers = 8, dry_run = False):
+    # Returns the FastresumeFile pointing the torrent at its matches, nothing is written yet.
+    # verify saves the hashed pieces so qBittorrent skips the recheck, materialize links the
+    # torrent layout under that dir and points the torrent there instead
+    fastresume_file = FastresumeFile(bt_backup, torrent_files.hash, torrent_files)
+    if materialize:
+        materialize = os.path.abspath(materialize)
+        LayoutMaterializer(materialize, link_workers).materialize(torrent_files, dry_run)
+        fastresume_file.set_materialized(materialize)
+    if verify:
+        fastresume_file.set_pieces(torrent_files.hash_pieces(hash_workers or os.cpu_count() or 1))
+    return fastresume_file
+
+def apply(plans, journal_dir = None, web_api = None, dry_run = False, check_process = True, results = None):
+    # Writes the planned fastresume files as one journaled transaction, or relocates each torrent
+    # through web_api, and returns a TorrentResult per plan: updated, unchanged, dry run or failed.
+    # results are the TorrentResults returned by match, in the order of plans, new ones when None.
+    # journal_dir defaults to the journal of the BT_backup of the first plan. Raises WriteError
+    # when the transaction fails, none of the files are changed then
+    plans = list(plans)
+    results = results or [TorrentResult(x.hash) for x in plans]
+    if not plans:
+        return results
+    writer = None if web_api else FastresumeWriter(journal_dir or get_journal_default(os.path.dirname(plans[0].fastresume_path)), dry_run)
+    staged = []
+    for fastresume_file, result in zip(plans, results):
+        try:
+            if web_api:
+                changed = web_api.relocate(fastresume_file.hash, fastresume_file.save_path, fastresume_file.mapped_files)
+            else:
+                changed = writer.stage(fastresume_file)
+            if not changed:
+                result.status = 'unchanged'
+            elif web_api:
+                result.status = 'updated'
+            else:
+                staged.append(result)
+        except (OSError, QbitAutomatchError) as e:
+            print('ERROR: Could not update ' + fastresume_file.hash + ': ' + str(e))
+            result.status = 'failed'
+            result.error = str(e)
+    if writer and writer.dry_run:
+        writer.print_changes()
+        for result in staged:
+            result.status = 'dry run'
+    elif staged:
+        try:
+            writer.commit(check_process)
+        except OSError as e:
+            for result in staged:
+                result.status = 'failed'
+                result.error = str(e)
+            raise WriteError('Could not write the fastresume files, none of them were changed: ' + str(e))
+        for result in staged:
+            result.status = 'updated'
+    return results
+
+def rollback(bt_backup, journal = None, journal_dir = None, check_process = True):
+    # Restores the fastresume files of a journaled batch, the latest one when journal is None,
+    # and returns the manifest entries of the restored files
+    return FastresumeWriter(journal_dir or get_journal_default(bt_backup)).rollback(journal, check_process)
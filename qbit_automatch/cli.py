@@ -0,0 +1,427 @@
+import os
+import sys
+import json
+import time
+import argparse
+from . import api
+from .core import TorrentFiles, TorrentResult, FastresumeFile, LayoutMaterializer, ReverseIndex, WebApiClient, Metrics, PersistentIndex, FileFilter, ComplexEncoder, is_sha1_hash, list_bt_backup_hashes, read_hashes_file, read_torrent_info, iter_search_files, create_watcher, check_process_running, line_separator, get_bt_backup_default, get_index_default
+from .errors import QbitAutomatchError, TorrentParseError, UnmatchedFilesError, CancelledError
+
+class ReadablePath(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        input_paths=[]
+        for input_path in (values if isinstance(values, list) else [values]):
+            if not os.path.isdir(input_path):
+                raise SystemExit('FATAL: "' + input_path + '" is not a valid path')
+            if not os.access(input_path, os.R_OK):
+                raise SystemExit('FATAL: "' + input_path + '" is not readable')
+            input_paths.append(os.path.abspath(input_path))
+        setattr(namespace,self.dest,input_paths if isinstance(values, list) else input_paths[0])
+
+class SHA1Hash(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        input_hash=values
+        if not is_sha1_hash(input_hash):
+            raise SystemExit('FATAL: "' + input_hash + '" is not a valid hash, check --help')
+        setattr(namespace,self.dest,input_hash)
+
+class ReadableFile(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        input_path=values
+        if not os.path.isfile(input_path):
+            raise SystemExit('FATAL: "' + input_path + '" is not a valid file')
+        if not os.access(input_path, os.R_OK):
+            raise SystemExit('FATAL: "' + input_path + '" is not readable')
+        input_path = os.path.abspath(input_path)
+        setattr(namespace,self.dest,input_path)
+
+def parse_input():
+    parser=argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group('required arguments')
+    parser._action_groups.append(optional)
+    torrents = required.add_mutually_exclusive_group(required=True)
+    torrents.add_argument('-a', '--hash', action=SHA1Hash, help='Torrent hash. In qBittorrent right click the torrent -> copy -> hash')
+    torrents.add_argument('--all', action='store_true', help='Match every torrent in BT_backup against one scan of the search dir')
+    torrents.add_argument('--hashes_from', metavar='FILE', action=ReadableFile, help='Match every torrent hash listed in FILE, one per line')
+    torrents.add_argument('--cross_seed', action='store_true', help='List the torrents of BT_backup (or --torrents_dir) the search dir can serve, fully or partly,\nranked by the bytes covered. Nothing is changed')
+    torrents.add_argument('--rollback', metavar='JOURNAL', nargs='?', const='latest', help='Restore the fastresume files changed by a journaled batch, the latest one by default.\nJOURNAL is a dir name inside --journal_dir or a path')
+    torrents.add_argument('--watch', action='store_true', help='Keep running and match every torrent added to BT_backup against a live index of the search dir.\nThe fastresume files are updated together the next time qBittorrent is closed')
+    required.add_argument('-s', '--search_dir', metavar='PATH', nargs='+', action=ReadablePath, help='Where to search for the files. Must be an absolute path, more than one can be given')
+    optional.add_argument('-b', '--bt_backup', metavar='PATH', default=get_bt_backup_default(), action=ReadablePath, help='BT_backup location, defaults to:\nWindows: C:\\Users\\<username>\\AppData\\Local\\qBittorrent\\BT_backup\nLinux: /home/<username>/.local/share/data/qBittorrent/BT_backup\nOS X: /Users/<username/Library/ApplicationSupport/qBittorrent/BT_backup')
+    optional.add_argument('-f', '--fix_duplicates', metavar='N', default=0, type=int, choices=range(0, 5), help='Values:\n0: throw an error when duplicates are found\n1: be prompted to choose files when duplicates are found\n2: use fuzzy string matching and choose files automatically\n3: use fuzzy string matching and choose files automatically but be prompted before proceeding\n4: hash the torrent pieces inside each candidate and choose the one that matches\nDefaults to 0')
+    optional.add_argument('--torrents_dir', metavar='PATH', action=ReadablePath, help='With --cross_seed, index every .torrent file below PATH instead of BT_backup')
+    optional.add_argument('--min_coverage', metavar='PERCENT', default=0, type=float, help='With --cross_seed, only list torrents with at least PERCENT of their bytes covered. Defaults to 0')
+    optional.add_argument('--materialize', metavar='DIR', help='Recreate the torrent layout under DIR with hardlinks to the matched files, or reflinks when DIR is on\nanother subvolume, and point qBittorrent at DIR without mapped_files. No data is copied')
+    optional.add_argument('--link_workers', metavar='N', default=8, type=int, help='Threads creating the links of --materialize. Defaults to 8')
+    optional.add_argument('--dry_run', action='store_true', help='Print the fastresume keys that would change instead of writing them')
+    optional.add_argument('--journal_dir', metavar='PATH', help='Where the original fastresume files of every batch are kept for --rollback. Defaults to BT_backup/qbit_automatch_journal')
+    optional.add_argument('--web_api', metavar='URL', help='Apply the new paths through the qBittorrent Web API at URL (e.g. http://localhost:8080) while it keeps running,\ninstead of editing the fastresume files. The file list is read from qBittorrent and the torrent is rechecked')
+    optional.add_argument('--web_api_user', metavar='USER', help='Web API username, not needed when qBittorrent skips authentication for localhost')
+    optional.add_argument('--web_api_password', metavar='PASSWORD', default=os.getenv('QBT_PASSWORD'), help='Web API password. Defaults to the QBT_PASSWORD environment variable')
+    optional.add_argument('--web_api_workers', metavar='N', default=8, type=int, help='Parallel keep-alive connections renaming files through the Web API. Defaults to 8')
+    optional.add_argument('--watch_interval', metavar='SECONDS', default=2, type=float, help='How often --watch checks whether qBittorrent was closed, and polls the dirs when inotify is unavailable. Defaults to 2')
+    optional.add_argument('--include', metavar='PATTERN', action='append', help='Only scan files whose name or path matches this glob, can be repeated')
+    optional.add_argument('--exclude', metavar='PATTERN', action='append', help='Skip files and dirs whose name or path matches this glob, can be repeated')
+    optional.add_argument('--max_depth', metavar='N', type=int, help='Don\'t scan deeper than N dirs below each search dir')
+    optional.add_argument('--scan_workers', metavar='N', default=8, type=int, help='Threads listing directories per device, rotational disks always use 1. Defaults to 8')
+    optional.add_argument('--verify', action='store_true', help='Hash every piece of the matched files and save the result in the fastresume file so qBittorrent doesn\'t need a recheck')
+    optional.add_argument('--hash_workers', metavar='N', default=os.cpu_count() or 1, type=int, help='Threads hashing pieces with --verify. Defaults to the number of cores')
+    optional.add_argument('--spill_index', action='store_true', help='Keep the search dir index paths in a tempfile instead of memory, for huge trees')
+    optional.add_argument('--index', metavar='PATH', nargs='?', const=get_index_default(), help='Keep a persistent index of the search dir and only rescan changed directories on later runs. PATH defaults to:\nWindows: C:\\Users\\<username>\\AppData\\Local\\qbit_automatch\\index.sqlite\nLinux: $XDG_CACHE_HOME/qbit_automatch/index.sqlite\nOS X: /Users/<username>/Library/Caches/qbit_automatch/index.sqlite')
+    optional.add_argument('--rescan', action='store_true', help='Rebuild the persistent index from scratch')
+    optional.add_argument('--index_stats', action='store_true', help='Print how many directories of the persistent index were reused or refreshed')
+    optional.add_argument('--metrics_json', metavar='PATH', help='Write wall time, counts and peak RSS of every phase to PATH')
+    optional.add_argument('--profile', metavar='PHASE', choices=Metrics.PHASES, help='Run cProfile around one phase and print the stats at the end. Values:\n' + ', '.join(Metrics.PHASES))
+    optional.add_argument('-d', '--debug', action='count', default=0, help='Enable debug, twice (-dd) also dumps every file and its matches')
+    input_args = parser.parse_args()
+    if not input_args.search_dir and not input_args.rollback:
+        parser.error('the following arguments are required: -s/--search_dir')
+    return input_args
+
+def check_python_version():
+    # time.time_ns and the lazy module __getattr__ of the package need 3.7
+    if sys.version_info < (3, 7):
+        raise SystemExit('FATAL: Python 3.7 or newer is required')
+
+def get_hashes(input_args, web_api = None):
+    if input_args.hash:
+        return [input_args.hash]
+    if input_args.watch:
+        return []
+    if input_args.hashes_from:
+        return read_hashes_file(input_args.hashes_from)
+    if web_api:
+        return web_api.get_hashes()
+    return list_bt_backup_hashes(input_args.bt_backup)
+
+def plan_torrent(input_args, search_dir, torrent_files, result, metrics):
+    print('INFO: Torrent name: ' + torrent_files.name)
+    if input_args.debug > 1:
+        print('DEBUG: torrent_files:' + json.dumps(torrent_files, cls=ComplexEncoder, indent = 2))
+    if input_args.debug:
+        print('DEBUG: Finding matches')
+    with metrics.phase('find_matches') as record:
+        try:
+            api.match(search_dir, torrent_files, result)
+        finally:
+            candidates = [x.get_matches_count() for x in torrent_files.files]
+            metrics.add(record, 'files', len(candidates))
+            metrics.add(record, 'candidates', sum(candidates))
+            record['candidates_max'] = max([record.get('candidates_max', 0)] + candidates)
+            if input_args.debug > 1:
+                print('DEBUG: After matches search')
+                print('DEBUG: torrent_files:' + json.dumps(torrent_files, cls=ComplexEncoder, indent = 2))
+
+    if input_args.debug:
+        print('DEBUG: Checking for multiple matches')
+    with metrics.phase('resolve_multiple') as record:
+        metrics.add(record, 'ambiguous_files', result.ambiguous)
+        torrent_files.resolve_multiple(input_args.fix_duplicates)
+
+    if input_args.debug > 1:
+        print('DEBUG: After multiple matches check')
+        print('DEBUG: torrent_files:' + json.dumps(torrent_files, cls=ComplexEncoder, indent = 2))
+    if input_args.debug:
+        print('DEBUG: Checking if two torrent files point to the same disk file')
+    with metrics.phase('check_duplicates'):
+        torrent_files.check_duplicates()
+
+    if input_args.debug:
+        print('DEBUG: Finished checking files')
+    fastresume_file = FastresumeFile(input_args.bt_backup, torrent_files.hash, torrent_files)
+
+    if input_args.materialize:
+        if input_args.debug:
+            print('DEBUG: Linking the torrent layout')
+        with metrics.phase('materialize') as record:
+            if input_args.dry_run:
+                print('INFO: Links that would be created:')
+            LayoutMaterializer(input_args.materialize, input_args.link_workers).materialize(torrent_files, input_args.dry_run)
+            metrics.add(record, 'files', len(torrent_files.files))
+        fastresume_file.set_materialized(input_args.materialize)
+
+    if input_args.verify:
+        if input_args.debug:
+            print('DEBUG: Verifying pieces')
+        with metrics.phase('verify') as record:
+            fastresume_file.set_pieces(torrent_files.hash_pieces(input_args.hash_workers))
+            metrics.add(record, 'bytes', torrent_files.total_size)
+
+    if input_args.debug > 1:
+        print('DEBUG: fastresume_file:' + json.dumps(fastresume_file, cls=ComplexEncoder, indent = 2))
+    return fastresume_file
+
+def apply_planned(planned, metrics, input_args, web_api = None, check_process = True):
+    # The fastresume files are written by one transaction with a single process check and the
+    # Web API relocates torrent by torrent. Only the failed plans are left in planned, all of
+    # them when the transaction fails
+    with metrics.phase('update_fastresume') as record:
+        results = api.apply([x[0] for x in planned], input_args.journal_dir, web_api, input_args.dry_run, check_process, [x[1] for x in planned])
+        metrics.add(record, 'updated', len([x for x in results if x.status == 'updated']))
+        planned[:] = [x for x in planned if x[1].failed()]
+
+def print_error(e):
+    # Unmatched files are listed one per line before the error itself
+    if isinstance(e, UnmatchedFilesError):
+        for path in e.paths:
+            print('ERROR: File "' + path + '" has no matches')
+
+def watch_bt_backup(input_args, search_dir, metrics, web_api = None):
+    # Torrents already in BT_backup are left alone, new ones are matched against the live
+    # index as soon as their fastresume exists and the updates wait for qBittorrent to close,
+    # or are sent right away through the Web API
+    bt_backup = input_args.bt_backup
+    known_hashes = set(list_bt_backup_hashes(bt_backup))
+    waiting = []
+    planned = []
+    # Set when applying failed, the plans are tried again once qBittorrent was running or a
+    # new torrent is planned instead of on every check
+    apply_failed = False
+    watcher = create_watcher([bt_backup] + list(search_dir.listed_dirs), input_args.watch_interval)
+    def watch(path):
+        try:
+            watcher.watch(path)
+        except OSError as e:
+            print('ERROR: Could not watch "' + path + '": ' + str(e) + ', raise fs.inotify.max_user_watches or restart to poll')
+    print('INFO: Watching ' + str(len(search_dir.listed_dirs)) + ' dirs and BT_backup, ' + str(len(known_hashes)) + ' torrents already in BT_backup are skipped. Ctrl+C to stop')
+    try:
+        while True:
+            changed = watcher.read_events(input_args.watch_interval)
+            retry = []
+            if changed - set([bt_backup]):
+                with metrics.phase('search_dir') as record:
+                    added, removed = search_dir.refresh_dirs(changed - set([bt_backup]), watch)
+                    metrics.add(record, 'dirs_refreshed', len(changed - set([bt_backup])))
+                for path in removed:
+                    watcher.unwatch(path)
+                if input_args.debug:
+                    print('DEBUG: ' + str(len(changed)) + ' dirs changed, ' + str(search_dir.files_count) + ' files indexed')
+                # Torrents missing files get another chance whenever the search dir changes
+                retry, waiting = waiting, []
+            new_hashes = []
+            if bt_backup in changed:
+                for hash in list_bt_backup_hashes(bt_backup):
+                    if hash not in known_hashes and os.path.isfile(os.path.join(bt_backup, hash + '.fastresume')):
+                        known_hashes.add(hash)
+                        new_hashes.append(hash)
+            for hash in retry + new_hashes:
+                started = time.perf_counter()
+                result = TorrentResult(hash)
+                try:
+                    # Through the Web API the file list is the one relocate renames, without pad files
+                    with metrics.phase('parse'):
+                        torrent_files = api.parse_torrent(bt_backup, hash, web_api)
+                except TorrentParseError as e:
+                    # Most likely still being written, parsed again on the next BT_backup change
+                    print('ERROR: ' + str(e) + ', retrying when BT_backup changes')
+                    known_hashes.discard(hash)
+                    continue
+                try:
+                    planned.append((plan_torrent(input_args, search_dir, torrent_files, result, metrics), result))
+                    apply_failed = False
+                    print('INFO: Planned ' + hash + ' in ' + '{:.1f}'.format((time.perf_counter() - started) * 1000) + ' ms' + ('' if web_api else ', ' + str(len(planned)) + ' updates waiting for qBittorrent to close'))
+                except (OSError, QbitAutomatchError) as e:
+                    print_error(e)
+                    print('ERROR: Could not match torrent ' + hash + ': ' + str(e) + ', retrying when the search dir changes')
+                    waiting.append(hash)
+                line_separator()
+            if planned and not web_api and check_process_running('qbittorrent'):
+                apply_failed = False
+            elif planned and not apply_failed:
+                if not web_api:
+                    print('INFO: qBittorrent is not running, applying ' + str(len(planned)) + ' planned updates')
+                results = [x[1] for x in planned]
+                try:
+                    apply_planned(planned, metrics, input_args, web_api, check_process = False)
+                except (OSError, QbitAutomatchError) as e:
+                    print('ERROR: ' + str(e))
+                print_summary(results)
+                if planned:
+                    apply_failed = True
+                    print('INFO: ' + str(len(planned)) + ' updates stay planned, retrying after qBittorrent runs again or a new torrent is planned')
+    except KeyboardInterrupt:
+        print('INFO: Stopped watching, ' + str(len(planned)) + ' planned updates were not applied')
+    finally:
+        watcher.close()
+
+def get_torrent_paths(input_args):
+    # (label, path) of the torrents to index, hashes for BT_backup and paths for --torrents_dir
+    if not input_args.torrents_dir:
+        return [(x, os.path.join(input_args.bt_backup, x + '.torrent')) for x in list_bt_backup_hashes(input_args.bt_backup)]
+    torrent_paths = []
+    for root, subdirs, files in os.walk(input_args.torrents_dir):
+        subdirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.torrent'):
+                path = os.path.join(root, filename)
+                torrent_paths.append((os.path.relpath(path, input_args.torrents_dir), path))
+    return torrent_paths
+
+def cross_seed(input_args, metrics):
+    # The reverse of matching: one scan of the search dir tells which torrents it can serve.
+    # Torrents are printed as soon as every file is covered, then all of them are ranked
+    reverse_index = ReverseIndex()
+    with metrics.phase('parse') as record:
+        for label, path in get_torrent_paths(input_args):
+            try:
+                reverse_index.add_torrent(label, read_torrent_info(path))
+            except (OSError, KeyError, TypeError, ValueError) as e:
+                print('ERROR: ' + str(TorrentParseError(label, str(e))))
+        reverse_index.build()
+        metrics.add(record, 'files', len(reverse_index.file_sizes))
+    print('INFO: ' + str(len(reverse_index.torrents)) + ' torrents with ' + str(len(reverse_index.file_sizes)) + ' files indexed')
+    persistent_index = None
+    try:
+        with metrics.phase('cross_seed') as record:
+            if input_args.index:
+                persistent_index = PersistentIndex(input_args.index, input_args.rescan)
+            file_filter = FileFilter(reverse_index.wanted, input_args.include, input_args.exclude, input_args.max_depth)
+            def add_files(files):
+                reverse_index.add_files(files)
+                for torrent_id in reverse_index.pop_complete():
+                    print('INFO: Complete: ' + reverse_index.describe(torrent_id))
+            files = []
+            for path, size in iter_search_files(input_args.search_dir, persistent_index, input_args.scan_workers, file_filter):
+                files.append((path, size))
+                if len(files) >= ReverseIndex.CHUNK_SIZE:
+                    add_files(files)
+                    files = []
+            add_files(files)
+            metrics.add(record, 'files', reverse_index.library_files_count)
+    finally:
+        if persistent_index:
+            persistent_index.close()
+    if input_args.index_stats and persistent_index:
+        print('INFO: ' + persistent_index.get_stats() + ', ' + str(reverse_index.library_files_count) + ' files')
+    ranking = reverse_index.get_ranking(input_args.min_coverage)
+    print('INFO: ' + str(len(ranking)) + ' torrents covered by ' + str(reverse_index.library_files_count) + ' files, by bytes covered:')
+    for torrent_id, files_covered, bytes_covered in ranking:
+        print('  ' + reverse_index.describe(torrent_id, files_covered, bytes_covered))
+    return ranking
+
+def print_summary(results):
+    print('INFO: Summary')
+    for result in results:
+        print('  ' + str(result))
+
+def run():
+    check_python_version()
+    input_args = parse_input()
+    batch = input_args.hash is None and not input_args.watch
+    if input_args.watch and input_args.fix_duplicates in [TorrentFiles.PROMPT, TorrentFiles.FUZZY_PROMPT]:
+        raise SystemExit('FATAL: --watch can\'t prompt, use --fix_duplicates 0, 2 or 4')
+    if input_args.web_api and input_args.verify:
+        raise SystemExit('FATAL: --verify can\'t be saved through --web_api, qBittorrent rechecks the torrent instead')
+    if input_args.materialize:
+        input_args.materialize = os.path.abspath(input_args.materialize)
+    if input_args.web_api and input_args.dry_run:
+        raise SystemExit('FATAL: --dry_run only applies to fastresume files, not to --web_api')
+    if input_args.debug:
+        print('DEBUG: input_args:' + json.dumps(dict(vars(input_args), web_api_password = input_args.web_api_password and '***'), cls=ComplexEncoder, indent = 2))
+    if input_args.cross_seed:
+        metrics = Metrics(input_args.profile)
+        try:
+            cross_seed(input_args, metrics)
+        finally:
+            if input_args.metrics_json:
+                metrics.write(input_args.metrics_json)
+            metrics.print_profile()
+        print('INFO: Done')
+        return
+    if input_args.rollback:
+        api.rollback(input_args.bt_backup, None if input_args.rollback == 'latest' else input_args.rollback, input_args.journal_dir)
+        print('INFO: Done')
+        return
+    results = []
+    torrents = []
+    planned = []
+    metrics = Metrics(input_args.profile)
+    web_api = None
+    try:
+        if input_args.web_api:
+            web_api = WebApiClient(input_args.web_api, input_args.web_api_user, input_args.web_api_password, input_args.web_api_workers)
+            web_api.login()
+        for hash in get_hashes(input_args, web_api):
+            result = TorrentResult(hash)
+            results.append(result)
+            if input_args.debug:
+                print('DEBUG: Opening torrent file ' + hash)
+            try:
+                with metrics.phase('parse') as record:
+                    torrent_files = api.parse_torrent(input_args.bt_backup, hash, web_api)
+                    metrics.add(record, 'files', len(torrent_files.files))
+                torrents.append((torrent_files, result))
+            except TorrentParseError as e:
+                if not batch:
+                    raise
+                print('ERROR: ' + str(e))
+                result.status = 'failed'
+                result.error = str(e)
+        if batch:
+            print('INFO: ' + str(len(torrents)) + ' torrents to match')
+
+        if input_args.debug:
+            print('DEBUG: Opening search dir and creating index')
+        with metrics.phase('search_dir') as record:
+            # Only files with the size and extension of a torrent file can ever match,
+            # torrents added later in watch mode can match anything
+            search_dir = api.scan(input_args.search_dir, None if input_args.watch else [x[0] for x in torrents], input_args.include, input_args.exclude, input_args.max_depth, input_args.index, input_args.rescan, input_args.scan_workers, input_args.spill_index)
+            metrics.add(record, 'files', search_dir.files_count)
+            metrics.add(record, 'bytes', search_dir.total_size)
+        if input_args.index_stats and search_dir.persistent_index:
+            print('INFO: ' + search_dir.persistent_index.get_stats() + ', ' + str(search_dir.files_count) + ' files')
+
+        if input_args.debug:
+            print('DEBUG: search_dir:' + json.dumps(search_dir, cls=ComplexEncoder, indent = 2))
+        if input_args.watch:
+            watch_bt_backup(input_args, search_dir, metrics, web_api)
+        for torrent_files, result in torrents:
+            if not batch:
+                planned.append((plan_torrent(input_args, search_dir, torrent_files, result, metrics), result))
+                continue
+            try:
+                planned.append((plan_torrent(input_args, search_dir, torrent_files, result, metrics), result))
+            except CancelledError:
+                result.status = 'skipped'
+            except (OSError, QbitAutomatchError) as e:
+                print_error(e)
+                print('FATAL: ' + str(e))
+                result.status = 'failed'
+                result.error = str(e)
+            line_separator()
+        if planned:
+            if input_args.debug:
+                print('DEBUG: Updating ' + str(len(planned)) + ' torrents')
+            apply_planned(planned, metrics, input_args, web_api)
+            if not batch and results[0].failed():
+                raise SystemExit('FATAL: ' + results[0].error)
+    finally:
+        try:
+            search_dir.close()
+        except Exception:
+            pass
+        if web_api:
+            web_api.close()
+        if input_args.metrics_json:
+            metrics.write(input_args.metrics_json)
+        metrics.print_profile()
+    if batch:
+        print_summary(results)
+        failed = len([x for x in results if x.failed()])
+        if failed:
+            raise SystemExit('FATAL: ' + str(failed) + ' of ' + str(len(results)) + ' torrents failed')
+    print('INFO: Done')
+
+def main():
+    # Errors of the library end the run as FATAL, declining the fuzzy matches is a clean exit
+    try:
+        run()
+    except CancelledError:
+        print('INFO: Exiting')
+    except QbitAutomatchError as e:
+        print_error(e)
+        raise SystemExit('FATAL: ' + str(e))
+
+if __name__ == "__main__":
+    main()
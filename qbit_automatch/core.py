@@ -0,0 +1,2036 @@
+import os
+import sys
+import errno
+import json
+import mmap
+import time
+import bisect
+import hashlib
+import cProfile
+import pstats
+import importlib
+import select
+import struct
+import ctypes
+import ctypes.util
+import sqlite3
+import threading
+import queue
+import http.client
+import urllib.parse
+import contextlib
+from array import array
+from fnmatch import fnmatch
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+import numpy
+from .errors import QbitAutomatchError, MissingDependencyError, MatchError, UnmatchedFilesError, DuplicateMatchesError, CancelledError, UnsupportedTorrentError, ProcessRunningError, JournalError, MaterializeError, WebApiError
+
+HASH_CHUNK_SIZE = 64 * 1024 * 1024
+# Leaves of the v2 merkle trees
+MERKLE_BLOCK_SIZE = 16 * 1024
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+NO_EDGE = 10 ** 9
+
+class MyFile:
+    __slots__ = ()
+    def get_file_name(self):
+        return os.path.basename(self.path)
+    def get_extension(self):
+        return os.path.splitext(self.path)[1]
+    def __eq__(self, other):
+        if isinstance(other, MyFile):
+            if self.size == other.size and self.get_extension() == other.get_extension():
+                return True
+            return False
+        return self == other
+
+class JSONSerializable:
+    __slots__ = ()
+    def repr_json(self):
+        raise NotImplementedError('You must implement this method.')
+    def to_json(self):
+        return json.dumps(self.repr_json())
+
+class ComplexEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, JSONSerializable):
+            return obj.repr_json()
+        else:
+            return json.JSONEncoder.default(self, obj)
+
+class FileInTorrent(MyFile, JSONSerializable):
+    __slots__ = ('path', 'size', 'offset', 'matches', 'index', 'pieces_root')
+    def __init__(self, path, size, offset = 0, index = 0, pieces_root = None):
+        if type(path) == list:
+            self.path = os.sep.join(path)
+        else:
+            self.path = path
+        self.size = int(size)
+        self.offset = offset
+        self.matches = []
+        # Position in the libtorrent file storage, which counts pad files
+        self.index = index
+        # v2 merkle root of the content, None for v1 files
+        self.pieces_root = pieces_root
+    def get_full_pieces(self, piece_length, pieces, total_size):
+        # Pieces that lie entirely inside this file as (start in file, length, sha1)
+        full_pieces = []
+        first_piece = -(-self.offset // piece_length)
+        for piece_index in range(first_piece, len(pieces) // 20):
+            piece_start = piece_index * piece_length
+            piece_end = min(piece_start + piece_length, total_size)
+            if piece_end > self.offset + self.size:
+                break
+            full_pieces.append((piece_start - self.offset, piece_end - piece_start, pieces[piece_index * 20:piece_index * 20 + 20]))
+        # A wrong candidate usually fails on its first or last piece
+        if len(full_pieces) > 2:
+            full_pieces = [full_pieces[0], full_pieces[-1]] + full_pieces[1:-1]
+        return full_pieces
+    def set_single_match(self, match):
+        self.matches.clear()
+        self.matches.append(match)
+    def get_match(self):
+        return self.matches[0]
+    def get_matches_count(self):
+        return len(self.matches)
+    def repr_json(self):
+        return {'path':self.path, 'size':self.size, 'offset':self.offset, 'pieces_root':self.pieces_root.hex() if self.pieces_root else None, 'matches':self.matches}
+
+class FileInDisk(MyFile, JSONSerializable):
+    __slots__ = ('path', 'size')
+    def __init__(self, **kwargs):
+        if 'json' in kwargs:
+            json_decoded = json.loads(kwargs['json'].rstrip())
+            self.path = json_decoded['path']
+            self.size = json_decoded['size']
+        else:
+            self.path = kwargs['path']
+            self.size = int(kwargs['size'])
+    def repr_json(self):
+        return {'path':self.path, 'size':self.size}
+
+class FastresumeFile(JSONSerializable):
+    def __init__(self, bt_backup, hash, torrent_files):
+        self.hash = hash
+        self.fastresume_path = os.path.join(bt_backup, hash + '.fastresume')
+        self.fastresume_bkp_path = self.fastresume_path + '.bkp'
+        self.mapped_files = []
+        self.save_path = ''
+        self.pieces = None
+        self.set_save_path(torrent_files)
+        self.set_mapped_files(torrent_files)
+    def set_mapped_files(self, torrent_files):
+        # Pad files keep an empty path, which libtorrent reads as not renamed
+        self.mapped_files = [''] * torrent_files.storage_files_count
+        for file_in_torrent in torrent_files.files:
+            relpath=os.path.relpath(file_in_torrent.get_match().path, self.save_path)
+            self.mapped_files[file_in_torrent.index] = relpath
+    def set_save_path(self, torrent_files):
+        self.save_path = str(Path(os.path.commonpath([x.get_match().path for x in torrent_files.files])).parent)
+    def set_materialized(self, target_dir):
+        # The linked tree has the torrent layout, so nothing needs mapping
+        self.save_path = target_dir
+        self.mapped_files = []
+    def set_pieces(self, pieces):
+        # libtorrent resume bitfield, one byte per piece with bit 0 set when we have it
+        self.pieces = pieces
+    def repr_json(self):
+        return {'hash':self.hash, 'fastresume_path':self.fastresume_path, 'fastresume_bkp_path':self.fastresume_bkp_path, 'save_path':self.save_path, 'mapped_files':self.mapped_files}
+    def get_updates(self):
+        updates = {'qBt-savePath':self.save_path, 'save_path':self.save_path, 'mapped_files':self.mapped_files, 'paused':1}
+        if self.pieces is not None:
+            updates['pieces'] = self.pieces
+        return updates
+    def read_updated(self):
+        # Returns (current data, updated data), the updated data is None when nothing changes.
+        # Only the updated keys are encoded, pieces/peers blobs are copied verbatim
+        with open(self.fastresume_path, 'rb') as file_handle:
+            fastresume_data = file_handle.read()
+        return fastresume_data, splice_bencoded_dict(fastresume_data, self.get_updates())
+
+class FastresumeWriter(JSONSerializable):
+    # Writes a batch of fastresume files as one transaction. The originals are linked into a
+    # journal dir listed by its manifest before any of them is replaced, and every new file
+    # is written to an fsynced temp file that is atomically renamed over the old one
+    PENDING = 'pending'
+    COMMITTED = 'committed'
+    ROLLED_BACK = 'rolled back'
+    def __init__(self, journal_root, dry_run = False):
+        self.journal_root = journal_root
+        self.dry_run = dry_run
+        self.staged = []
+        self.journal_path = None
+        self.written_count = 0
+    def stage(self, fastresume_file):
+        fastresume_data, fastresume_data_upd = fastresume_file.read_updated()
+        if fastresume_data_upd is None:
+            print('INFO: Fastresume data matches already, no changes made')
+            return False
+        self.staged.append((fastresume_file.fastresume_path, fastresume_data, fastresume_data_upd))
+        return True
+    def print_changes(self):
+        for fastresume_path, fastresume_data, fastresume_data_upd in self.staged:
+            print('INFO: Changes to ' + fastresume_path + ':')
+            for line in diff_bencoded_dicts(fastresume_data, fastresume_data_upd):
+                print('  ' + line)
+        self.staged = []
+    def commit(self, check_process = True):
+        # Returns the journal dir of the batch, None when nothing was staged
+        staged, self.staged = self.staged, []
+        if not staged:
+            return None
+        if check_process and check_process_running('qbittorrent'):
+            raise ProcessRunningError('qBittorrent is running, close it first')
+        started = time.perf_counter()
+        # mkdtemp keeps names unique when batches are committed within the same second
+        created_ns = time.time_ns()
+        os.makedirs(self.journal_root, exist_ok = True)
+        journal_path = tempfile.mkdtemp(prefix = time.strftime('%Y%m%d-%H%M%S', time.localtime(created_ns / 1e9)) + '.' + '{:06d}'.format(created_ns // 1000 % 1000000) + '-', dir = self.journal_root)
+        manifest = {'created':time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_ns / 1e9)), 'created_ns':created_ns, 'status':self.PENDING, 'files':[]}
+        for fastresume_path, fastresume_data, fastresume_data_upd in staged:
+            backup_name = os.path.basename(fastresume_path)
+            link_or_write(fastresume_path, os.path.join(journal_path, backup_name), fastresume_data)
+            if not os.path.isfile(fastresume_path + '.bkp'):
+                link_or_write(fastresume_path, fastresume_path + '.bkp', fastresume_data)
+            manifest['files'].append({'fastresume_path':fastresume_path, 'backup':backup_name})
+        fsync_dir(journal_path)
+        write_manifest(journal_path, manifest)
+        replaced = []
+        try:
+            for fastresume_path, fastresume_data, fastresume_data_upd in staged:
+                write_atomic(fastresume_path, fastresume_data_upd, sync_dir = False)
+                replaced.append((fastresume_path, fastresume_data))
+            for directory in set(os.path.dirname(x[0]) for x in staged):
+                fsync_dir(directory)
+        except OSError:
+            print('ERROR: Writing the fastresume files failed, restoring the ' + str(len(replaced)) + ' already written')
+            for fastresume_path, fastresume_data in replaced:
+                write_atomic(fastresume_path, fastresume_data)
+            manifest['status'] = self.ROLLED_BACK
+            write_manifest(journal_path, manifest)
+            raise
+        manifest['status'] = self.COMMITTED
+        write_manifest(journal_path, manifest)
+        self.journal_path = journal_path
+        self.written_count += len(staged)
+        print('INFO: Wrote ' + str(len(staged)) + ' fastresume files in ' + '{:.2f}'.format(time.perf_counter() - started) + 's, undo with --rollback "' + journal_path + '"')
+        return journal_path
+    def get_latest_journal(self):
+        # Newest created_ns first. Journals written before it was kept sort by name, whose
+        # -<pid> suffix isn't ordered within the same second
+        journals = []
+        for name in (os.listdir(self.journal_root) if os.path.isdir(self.journal_root) else []):
+            manifest = read_manifest(os.path.join(self.journal_root, name))
+            if manifest and manifest['status'] != self.ROLLED_BACK:
+                journals.append((manifest.get('created_ns', 0), name))
+        if not journals:
+            raise JournalError('No journal to roll back in "' + self.journal_root + '"')
+        return os.path.join(self.journal_root, max(journals)[1])
+    def rollback(self, journal = None, check_process = True):
+        # journal is a dir name inside journal_root or a path, the latest one when None.
+        # Pending journals of an interrupted batch are restored the same way
+        journal_path = self.get_latest_journal() if journal is None else os.path.join(self.journal_root, journal)
+        manifest = read_manifest(journal_path)
+        if manifest is None:
+            raise JournalError('"' + journal_path + '" is not a journal')
+        if manifest['status'] == self.ROLLED_BACK:
+            raise JournalError('"' + journal_path + '" was rolled back already')
+        if check_process and check_process_running('qbittorrent'):
+            raise ProcessRunningError('qBittorrent is running, close it first')
+        for entry in manifest['files']:
+            backup_path = os.path.join(journal_path, entry['backup'])
+            with open(backup_path, 'rb') as file_handle:
+                write_atomic(entry['fastresume_path'], file_handle.read(), sync_dir = False, metadata_path = backup_path)
+        for directory in set(os.path.dirname(x['fastresume_path']) for x in manifest['files']):
+            fsync_dir(directory)
+        manifest['status'] = self.ROLLED_BACK
+        write_manifest(journal_path, manifest)
+        print('INFO: Restored ' + str(len(manifest['files'])) + ' fastresume files from "' + journal_path + '"')
+        return manifest['files']
+    def repr_json(self):
+        return {'journal_root':self.journal_root, 'dry_run':self.dry_run, 'journal_path':self.journal_path, 'written_count':self.written_count}
+
+class LayoutMaterializer(JSONSerializable):
+    # Recreates the torrent layout under target_dir out of hardlinks to the matched files,
+    # or reflinks when they are on another device. No data is ever copied
+    def __init__(self, target_dir, workers = 8):
+        self.target_dir = target_dir
+        self.workers = workers
+        self.counts = {'hardlinked':0, 'reflinked':0, 'already linked':0}
+    def get_links(self, torrent_files):
+        links = []
+        for file_in_torrent in torrent_files.files:
+            link_path = os.path.normpath(os.path.join(self.target_dir, torrent_files.get_layout_path(file_in_torrent)))
+            if not link_path.startswith(os.path.join(self.target_dir, '')):
+                raise MaterializeError('"' + file_in_torrent.path + '" would be linked outside of "' + self.target_dir + '"')
+            links.append((file_in_torrent.get_match().path, link_path))
+        return links
+    def materialize(self, torrent_files, dry_run = False):
+        links = self.get_links(torrent_files)
+        if dry_run:
+            for path, link_path in links:
+                print('  ' + link_path + ' -> ' + path)
+            return
+        for directory in sorted(set(os.path.dirname(x[1]) for x in links)):
+            try:
+                os.makedirs(directory, exist_ok = True)
+            except OSError as e:
+                raise MaterializeError('Could not create "' + directory + '": ' + (e.strerror or str(e)))
+        created = []
+        errors = []
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            futures = [(executor.submit(link_file, path, link_path), path, link_path) for path, link_path in links]
+            for future, path, link_path in futures:
+                try:
+                    kind = future.result()
+                except OSError as e:
+                    errors.append('"' + path + '": ' + (e.strerror or str(e)))
+                    continue
+                self.counts[kind] += 1
+                if kind != 'already linked':
+                    created.append(link_path)
+        if errors:
+            # Nothing is left half linked, the links of this torrent are removed again
+            for link_path in created:
+                with contextlib.suppress(OSError):
+                    os.remove(link_path)
+            for error in errors:
+                print('ERROR: Could not link ' + error)
+            raise MaterializeError(str(len(errors)) + ' files can\'t be hardlinked or reflinked into "' + self.target_dir + '", it must be on the same filesystem as the files')
+        print('INFO: Linked ' + str(len(links)) + ' files under "' + self.target_dir + '": ' + ', '.join(str(count) + ' ' + kind for kind, count in self.counts.items() if count))
+    def repr_json(self):
+        return {'target_dir':self.target_dir, 'workers':self.workers, 'counts':self.counts}
+
+class WebApiClient(JSONSerializable):
+    # qBittorrent Web API over keep-alive connections, one per thread so renames can run in parallel
+    def __init__(self, url, username = None, password = None, workers = 8):
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.workers = workers
+        self.cookie = None
+        self.local = threading.local()
+        self.connections = []
+        self.requests_count = 0
+        url_parts = urllib.parse.urlsplit(self.url)
+        self.connection_class = http.client.HTTPSConnection if url_parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = url_parts.netloc
+        self.base_path = url_parts.path
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.netloc, timeout = 60)
+            self.connections.append(connection)
+        return connection
+    def request(self, method, path, params = None):
+        body = urllib.parse.urlencode(params or {})
+        url = self.base_path + '/api/v2/' + path
+        headers = {'Referer':self.url}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if method == 'GET':
+            url += '?' + body if body else ''
+            body = None
+        else:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            connection = self.get_connection()
+            try:
+                connection.request(method, url, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # Idle keep-alive connections closed by the server get one retry on a new one
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise WebApiError('Web API request ' + path + ' to ' + self.url + ' failed: ' + str(e))
+        self.requests_count += 1
+        if response.status == 403:
+            raise WebApiError('Web API refused ' + path + ', check --web_api_user and --web_api_password')
+        if response.status != 200:
+            raise WebApiError('Web API ' + path + ' returned ' + str(response.status) + ': ' + data.decode('utf-8', 'replace'))
+        if path == 'auth/login' and response.getheader('Set-Cookie'):
+            self.cookie = response.getheader('Set-Cookie').split(';')[0]
+        return data
+    def get_json(self, path, params = None):
+        return json.loads(self.request('GET', path, params).decode('utf-8'))
+    def login(self):
+        if self.username is not None:
+            if self.request('POST', 'auth/login', {'username':self.username, 'password':self.password or ''}) != b'Ok.':
+                raise WebApiError('Web API login failed, check --web_api_user and --web_api_password')
+        version = self.request('GET', 'app/webapiVersion').decode('utf-8')
+        # renameFile takes oldPath/newPath since Web API 2.8 (qBittorrent 4.4)
+        if tuple(int(x) for x in version.split('.')[:2]) < (2, 8):
+            raise WebApiError('qBittorrent 4.4 or newer is required for --web_api, found Web API ' + version)
+    def get_hashes(self):
+        return sorted(x['hash'] for x in self.get_json('torrents/info'))
+    def get_files(self, hash):
+        return self.get_json('torrents/files', {'hash':hash})
+    def get_torrent_info(self, hash):
+        # Same shape as read_torrent_info, built without reading the .torrent
+        torrents = self.get_json('torrents/info', {'hashes':hash})
+        if not torrents:
+            raise KeyError('torrent ' + hash + ' not found in qBittorrent')
+        properties = self.get_json('torrents/properties', {'hash':hash})
+        files = [{'path':x['name'].split('/'), 'length':x['size']} for x in self.get_files(hash)]
+        return {'name':torrents[0]['name'], 'piece length':properties['piece_size'], 'files':files}
+    def get_piece_hashes(self, hash):
+        return b''.join(bytes.fromhex(x) for x in self.get_json('torrents/pieceHashes', {'hash':hash}))
+    def relocate(self, hash, save_path, mapped_files):
+        # setLocation, then one renameFolder per folder that moves as a whole and renameFile
+        # for the rest, each wave of them in parallel. When a request fails the ones already
+        # done are reverted. Returns False when nothing changed
+        torrent = self.get_json('torrents/info', {'hashes':hash})[0]
+        current_paths = [x['name'] for x in self.get_files(hash)]
+        # qBittorrent doesn't list pad files, mapped_files has an empty path for them
+        target_paths = [x.replace(os.sep, '/') for x in mapped_files if x]
+        if target_paths and len(target_paths) != len(current_paths):
+            raise WebApiError('qBittorrent lists ' + str(len(current_paths)) + ' files for ' + hash + ', the plan has ' + str(len(target_paths)))
+        folder_renames, file_waves = plan_renames(current_paths, target_paths)
+        move = os.path.normpath(torrent['save_path']) != os.path.normpath(save_path)
+        if not move and not folder_renames and not file_waves:
+            print('INFO: qBittorrent already uses these paths, no changes made')
+            return False
+        # (endpoint, params, undo params) of every request that went through
+        done = []
+        try:
+            if move:
+                self.request('POST', 'torrents/setLocation', {'hashes':hash, 'location':save_path})
+                done.append(('torrents/setLocation', {'hashes':hash, 'location':torrent['save_path']}))
+            for old_path, new_path in folder_renames:
+                self.request('POST', 'torrents/renameFolder', {'hash':hash, 'oldPath':old_path, 'newPath':new_path})
+                done.append(('torrents/renameFolder', {'hash':hash, 'oldPath':new_path, 'newPath':old_path}))
+            with ThreadPoolExecutor(max_workers = self.workers) as executor:
+                for wave in file_waves:
+                    futures = [(executor.submit(self.request, 'POST', 'torrents/renameFile', {'hash':hash, 'oldPath':x[0], 'newPath':x[1]}), x) for x in wave]
+                    errors = []
+                    for future, (old_path, new_path) in futures:
+                        try:
+                            future.result()
+                            done.append(('torrents/renameFile', {'hash':hash, 'oldPath':new_path, 'newPath':old_path}))
+                        except WebApiError as e:
+                            errors.append(e)
+                    if errors:
+                        raise errors[0]
+        except WebApiError as e:
+            self.undo(hash, done, e)
+        renames_count = sum(len(x) for x in file_waves)
+        print('INFO: ' + str(len(folder_renames)) + ' folders and ' + str(renames_count) + ' files renamed through the Web API')
+        self.request('POST', 'torrents/recheck', {'hashes':hash})
+        return True
+    def undo(self, hash, done, error):
+        # Reverts the requests of a failed relocate in reverse order, then raises
+        for path, params in reversed(done):
+            try:
+                self.request('POST', path, params)
+            except WebApiError as e:
+                raise WebApiError(str(error) + '. Undoing the ' + str(len(done)) + ' requests already made failed too (' + str(e) + '), ' + hash + ' is partly relocated, check it in qBittorrent')
+        raise WebApiError(str(error) + '. The ' + str(len(done)) + ' requests already made were undone')
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+    def repr_json(self):
+        return {'url':self.url, 'username':self.username, 'workers':self.workers, 'requests_count':self.requests_count}
+
+class FuzzyScores:
+    def __init__(self, rows, columns, matrix):
+        self.rows = rows
+        self.columns = columns
+        # levenshtein distances, lower is better
+        self.matrix = matrix
+    def get_cost(self, index, path):
+        if index not in self.rows:
+            return 0
+        return float(self.matrix[self.rows[index], self.columns[path]])
+    def get_best(self, index, paths):
+        # min keeps the first of equal distances, like extractOne
+        return min(paths, key = lambda path: self.get_cost(index, path))
+
+class BencodeReader:
+    # Walks bencoded bytes or mmap in place, values are only decoded when asked for
+    def __init__(self, data):
+        self.data = data
+    def string_span(self, pos):
+        colon = self.data.find(b':', pos)
+        return colon + 1, colon + 1 + int(self.data[pos:colon])
+    def skip(self, pos):
+        token = self.data[pos:pos + 1]
+        if token == b'i':
+            return self.data.find(b'e', pos) + 1
+        if token in [b'l', b'd']:
+            pos += 1
+            while self.data[pos:pos + 1] != b'e':
+                pos = self.skip(pos)
+            return pos + 1
+        return self.string_span(pos)[1]
+    def dict_items(self, pos):
+        # Yields (key, key position, value position, value end) of the dict at pos
+        pos += 1
+        while self.data[pos:pos + 1] != b'e':
+            key_start, key_end = self.string_span(pos)
+            value_end = self.skip(key_end)
+            yield self.data[key_start:key_end], pos, key_end, value_end
+            pos = value_end
+    def decode(self, pos):
+        token = self.data[pos:pos + 1]
+        if token == b'i':
+            end = self.data.find(b'e', pos)
+            return int(self.data[pos + 1:end]), end + 1
+        if token == b'l':
+            values = []
+            pos += 1
+            while self.data[pos:pos + 1] != b'e':
+                value, pos = self.decode(pos)
+                values.append(value)
+            return values, pos + 1
+        if token == b'd':
+            values = {}
+            for key, key_pos, value_pos, value_end in self.dict_items(pos):
+                values[decode_string(key)] = self.decode(value_pos)[0]
+            return values, self.skip(pos)
+        start, end = self.string_span(pos)
+        return decode_string(self.data[start:end]), end
+
+class TorrentFiles(JSONSerializable):
+    THROW_ERROR = 0
+    PROMPT = 1
+    FUZZY_AUTO = 2
+    FUZZY_PROMPT = 3
+    PIECE_HASH = 4
+    def __init__(self, bt_backup, hash, web_api = None):
+        self.hash = hash
+        self.web_api = web_api
+        self.files = []
+        if web_api:
+            self.torrent_path = None
+            info = web_api.get_torrent_info(hash)
+        else:
+            self.torrent_path = os.path.join(bt_backup, hash + '.torrent')
+            info = read_torrent_info(self.torrent_path)
+        self.name = info['name']
+        self.piece_length = int(info['piece length'])
+        # The piece table and v2 piece layers are only read from the torrent when hashing needs them
+        self.pieces_span = info.get('pieces')
+        self.pieces = None
+        self.piece_layers_span = info.get('piece layers')
+        self.piece_layers = None
+        self.files, self.storage_files_count, self.total_size = get_info_files(info)
+        self.multi_file = 'files' in info or ('length' not in info and [x.path for x in self.files] != [self.name])
+    def get_pieces(self):
+        if self.pieces is None and self.web_api:
+            self.pieces = self.web_api.get_piece_hashes(self.hash)
+        elif self.pieces is None and self.pieces_span is None:
+            # v2 only torrents have no v1 piece hashes
+            self.pieces = b''
+        elif self.pieces is None:
+            with open(self.torrent_path, 'rb') as file_handle:
+                file_handle.seek(self.pieces_span[0])
+                self.pieces = file_handle.read(self.pieces_span[1] - self.pieces_span[0])
+        return self.pieces
+    def get_piece_layers(self):
+        # pieces root -> piece hashes of every v2 file larger than one piece
+        if self.piece_layers is None:
+            self.piece_layers = {}
+            if self.piece_layers_span:
+                with open(self.torrent_path, 'rb') as file_handle:
+                    file_handle.seek(self.piece_layers_span[0])
+                    data = file_handle.read(self.piece_layers_span[1] - self.piece_layers_span[0])
+                reader = BencodeReader(data)
+                for key, key_pos, value_pos, value_end in reader.dict_items(0):
+                    start, end = reader.string_span(value_pos)
+                    self.piece_layers[key] = data[start:end]
+        return self.piece_layers
+    def verify_merkle_roots(self):
+        # v2 files carry the merkle root of their content, every candidate of the ambiguous
+        # ones is hashed in parallel and only the candidates with the same root are kept
+        files = [x for x in self.files if x.pieces_root and x.get_matches_count() > 1]
+        if not files:
+            return
+        piece_layers = self.get_piece_layers()
+        # Root of an all zero piece, pads the piece layer up to a power of two
+        piece_pad = merkle_root([], self.piece_length // MERKLE_BLOCK_SIZE)
+        with ProcessPoolExecutor() as executor:
+            futures = []
+            for file_in_torrent in files:
+                piece_layer = piece_layers.get(file_in_torrent.pieces_root)
+                # A layer that doesn't add up to the root is ignored and the whole tree hashed
+                if piece_layer is not None and merkle_root([piece_layer[x:x + 32] for x in range(0, len(piece_layer), 32)], len(piece_layer) // 32, piece_pad) != file_in_torrent.pieces_root:
+                    piece_layer = None
+                futures.append([executor.submit(verify_merkle_root, x.path, file_in_torrent.size, file_in_torrent.pieces_root, self.piece_length, piece_layer) for x in file_in_torrent.matches])
+            for file_in_torrent, file_futures in zip(files, futures):
+                verified = [match for match, future in zip(file_in_torrent.matches, file_futures) if future.result()]
+                if not verified:
+                    raise MatchError('No candidate of "' + file_in_torrent.path + '" matches its v2 merkle root')
+                if len(verified) == 1:
+                    print('INFO: "' + file_in_torrent.path + '" confirmed by its merkle root: ' + verified[0].path)
+                file_in_torrent.matches[:] = verified
+    def check_unmatched(self):
+        unmatched = [x.path for x in self.files if not x.matches]
+        if unmatched:
+            raise UnmatchedFilesError(unmatched)
+    def verify_candidates(self):
+        # Hash every candidate of every ambiguous file at once, spread over the cores
+        verified = {}
+        with ProcessPoolExecutor() as executor:
+            futures = {}
+            for file_in_torrent in self.files:
+                if file_in_torrent.get_matches_count() < 2:
+                    continue
+                full_pieces = file_in_torrent.get_full_pieces(self.piece_length, self.get_pieces(), self.total_size)
+                if not full_pieces:
+                    verified[file_in_torrent.path] = None
+                    continue
+                verified[file_in_torrent.path] = []
+                for match in file_in_torrent.matches:
+                    futures[executor.submit(verify_pieces, match.path, full_pieces)] = (file_in_torrent.path, match.path)
+            for future, (torrent_path, disk_path) in futures.items():
+                if future.result():
+                    verified[torrent_path].append(disk_path)
+        return verified
+    def hash_pieces(self, workers):
+        # Streams the matched files in torrent order, pieces spanning file boundaries included
+        if not self.get_pieces():
+            raise UnsupportedTorrentError('--verify needs v1 piece hashes, "' + self.name + '" is a v2 only torrent')
+        segments = [(x.get_match().path, x.offset, x.size) for x in self.files]
+        pieces = self.get_pieces()
+        pieces_count = len(pieces) // 20
+        chunk = max(1, HASH_CHUNK_SIZE // self.piece_length)
+        started = time.time()
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            futures = [executor.submit(hash_piece_range, segments, self.piece_length, self.total_size, pieces, x, min(x + chunk, pieces_count)) for x in range(0, pieces_count, chunk)]
+            bitfield = b''.join(x.result() for x in futures)
+        elapsed = time.time() - started
+        verified_count = bitfield.count(1)
+        print('INFO: Verified ' + str(verified_count) + '/' + str(pieces_count) + ' pieces, ' + format_size(self.total_size) + ' in ' + '{:.1f}'.format(elapsed) + 's (' + '{:.1f}'.format(self.total_size / 1048576 / max(elapsed, 0.001)) + ' MB/s)')
+        if verified_count != pieces_count:
+            print('WARNING: ' + str(pieces_count - verified_count) + ' pieces don\'t match, qBittorrent will download them again')
+        return bitfield
+    def get_layout_path(self, file_in_torrent):
+        # Path below save_path when no file is renamed, Web API file names include the root folder already
+        if self.multi_file and not self.web_api:
+            return os.path.join(self.name, file_in_torrent.path)
+        return file_in_torrent.path
+    def get_query(self, file_in_torrent):
+        return os.path.join(self.name, file_in_torrent.path)
+    def score_candidates(self, candidates):
+        # Every ambiguous file against every candidate path in a single cdist call,
+        # keys are processed once the same way extractOne processes them
+        rows = [x for x in range(len(candidates)) if len(candidates[x]) > 1]
+        columns = sorted(set(path for x in rows for path in candidates[x]))
+        if not rows:
+            return FuzzyScores({}, {}, None)
+        default_process = import_dependency('rapidfuzz.utils', 'rapidfuzz').default_process
+        # rapidfuzz.distance has the same Levenshtein distance in 2.x and 3.x
+        levenshtein = import_dependency('rapidfuzz.distance.Levenshtein', 'rapidfuzz').distance
+        queries = [default_process(self.get_query(self.files[x])) for x in rows]
+        choices = [default_process(path) for path in columns]
+        matrix = import_dependency('rapidfuzz.process', 'rapidfuzz').cdist(queries, choices, scorer = levenshtein, processor = None, workers = -1)
+        return FuzzyScores(dict((x, row) for row, x in enumerate(rows)), dict((path, column) for column, path in enumerate(columns)), matrix)
+    def assign_matches(self, candidates, preferred, scores, strict = True):
+        # Torrent files and their candidates form a bipartite graph, every connected
+        # component where the preferred matches collide is solved on its own as a
+        # min-cost assignment on the fuzzy scores
+        parent = list(range(len(candidates)))
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+        owner = {}
+        for index, paths in enumerate(candidates):
+            for path in paths:
+                if path in owner:
+                    parent[find(index)] = find(owner[path])
+                else:
+                    owner[path] = index
+        components = {}
+        for index in range(len(candidates)):
+            components.setdefault(find(index), []).append(index)
+        assigned = list(preferred)
+        unsatisfiable = []
+        for rows in components.values():
+            if len(set(preferred[x] for x in rows)) == len(rows):
+                continue
+            columns = sorted(set(path for x in rows for path in candidates[x]))
+            if len(columns) < len(rows):
+                unsatisfiable.append(rows)
+                continue
+            cost = []
+            for x in rows:
+                row_candidates = set(candidates[x])
+                cost.append([scores.get_cost(x, path) if path in row_candidates else NO_EDGE for path in columns])
+            solution = solve_assignment(cost)
+            if any(cost[row][column] >= NO_EDGE for row, column in enumerate(solution)):
+                unsatisfiable.append(rows)
+                continue
+            for row, column in enumerate(solution):
+                assigned[rows[row]] = columns[column]
+        if unsatisfiable and strict:
+            for rows in unsatisfiable:
+                print('ERROR: These files can\'t all have a different match:')
+                for x in rows:
+                    print('  "' + self.files[x].path + '": ' + ', '.join(candidates[x]))
+            raise DuplicateMatchesError(str(len(unsatisfiable)) + ' group(s) of files don\'t have enough candidates to give each file its own match')
+        return assigned
+    def choose_matches(self, mode, strict = True):
+        # Returns (fuzzy matches, best matches, verified candidates), one path per file. The
+        # best matches give every file its own candidate unless mode is THROW_ERROR, strict
+        # raises when some files can't have one
+        self.verify_merkle_roots()
+        verified = None
+        if mode == TorrentFiles.PIECE_HASH:
+            verified = self.verify_candidates()
+        candidates = []
+        fuzzymatches = []
+        for file_in_torrent in self.files:
+            paths = [x.path for x in file_in_torrent.matches]
+            if mode == TorrentFiles.PIECE_HASH and file_in_torrent.get_matches_count() > 1:
+                if verified[file_in_torrent.path] == []:
+                    raise MatchError('No candidate of "' + file_in_torrent.path + '" matches the torrent piece hashes')
+                if verified[file_in_torrent.path]:
+                    paths = verified[file_in_torrent.path]
+            candidates.append(paths)
+        scores = self.score_candidates(candidates)
+        for index, paths in enumerate(candidates):
+            fuzzymatches.append(scores.get_best(index, paths))
+        best_matches = fuzzymatches
+        if mode != TorrentFiles.THROW_ERROR:
+            best_matches = self.assign_matches(candidates, fuzzymatches, scores, strict)
+        return fuzzymatches, best_matches, verified
+    def resolve_multiple(self, mode):
+        dupicates_found = False
+        fuzzymatches, best_matches, verified = self.choose_matches(mode, strict = mode != TorrentFiles.PROMPT)
+        for index, file_in_torrent in enumerate(self.files):
+            if file_in_torrent.get_matches_count() > 1:
+                dupicates_found = True
+                print('File "' + file_in_torrent.path + '" has the following duplicates:')
+                matches_paths = []
+                for seq_no, x in enumerate(file_in_torrent.matches):
+                    matches_paths.append([str(seq_no), x.path])
+                fuzzymatch = best_matches[index]
+                best_match_seq_no = None
+                for seq_no, match in matches_paths:
+                    if fuzzymatch == match:
+                        print(' >[' + seq_no + '] ' + match)
+                        best_match_seq_no = seq_no
+                    else:
+                        print('  [' + seq_no + '] ' + match)
+                if mode == TorrentFiles.PROMPT:
+                    user_input = ask_user('Select one', list(zip(*matches_paths))[0], ret_type = 'int', default = best_match_seq_no)
+                    file_in_torrent.set_single_match(file_in_torrent.matches[user_input])
+                elif mode in [TorrentFiles.FUZZY_AUTO, TorrentFiles.FUZZY_PROMPT]:
+                    print('  Fuzzy match: ' + fuzzymatch)
+                    file_in_torrent.set_single_match(next(x for x in file_in_torrent.matches if x.path == fuzzymatch))
+                elif mode == TorrentFiles.PIECE_HASH:
+                    if verified[file_in_torrent.path] is None:
+                        print('  No piece lies entirely inside the file, fuzzy match: ' + fuzzymatch)
+                    else:
+                        print('  Piece hash match: ' + fuzzymatch)
+                    file_in_torrent.set_single_match(next(x for x in file_in_torrent.matches if x.path == fuzzymatch))
+                line_separator()
+        reassigned = len([x for x in range(len(self.files)) if best_matches[x] != fuzzymatches[x]])
+        if reassigned:
+            print('INFO: ' + str(reassigned) + ' file(s) got another candidate than their fuzzy match so no two files share a match')
+        if dupicates_found and mode == TorrentFiles.THROW_ERROR:
+            raise DuplicateMatchesError('duplicates found. This happens when 2 files have the same length and extension. You can run the script with --fix_duplicates to fix them. Check the help for possible values')
+        elif dupicates_found and mode == TorrentFiles.FUZZY_PROMPT:
+            if ask_user('Continue?', ['y', 'n']) == 'n':
+                raise CancelledError('Fuzzy matches not accepted')
+    def check_duplicates(self):
+        temp_list = []
+        for file in self.files:
+            temp_list.append(file.get_match().path)
+        if len(temp_list) != len(set(temp_list)):
+            raise DuplicateMatchesError('Duplicates found. Two files can\'t have the same match')
+    def find_matches(self, search_dir):
+        search_dir.search_files(self.files)
+    def repr_json(self):
+        return {'name':self.name, 'hash':self.hash, 'torrent_path':self.torrent_path, 'files':self.files}
+
+class TorrentResult(JSONSerializable):
+    def __init__(self, hash):
+        self.hash = hash
+        self.name = None
+        self.files_count = 0
+        self.matched = 0
+        self.ambiguous = 0
+        self.unmatched = 0
+        self.status = 'pending'
+        self.error = None
+    def count_matches(self, torrent_files):
+        self.name = torrent_files.name
+        self.files_count = len(torrent_files.files)
+        self.matched = len([x for x in torrent_files.files if x.get_matches_count() == 1])
+        self.ambiguous = len([x for x in torrent_files.files if x.get_matches_count() > 1])
+        self.unmatched = len([x for x in torrent_files.files if x.get_matches_count() == 0])
+    def failed(self):
+        return self.status == 'failed'
+    def __str__(self):
+        return '[' + self.status + '] ' + self.hash + ' ' + str(self.name) + ': ' + str(self.files_count) + ' files, ' + str(self.matched) + ' matched, ' + str(self.ambiguous) + ' ambiguous, ' + str(self.unmatched) + ' unmatched'
+    def repr_json(self):
+        return {'hash':self.hash, 'name':self.name, 'files_count':self.files_count, 'matched':self.matched, 'ambiguous':self.ambiguous, 'unmatched':self.unmatched, 'status':self.status, 'error':self.error}
+
+class Metrics(JSONSerializable):
+    PHASES = ['search_dir', 'parse', 'find_matches', 'resolve_multiple', 'check_duplicates', 'materialize', 'verify', 'update_fastresume', 'cross_seed']
+    def __init__(self, profile_phase = None):
+        # phase name -> totals over every call, so batches stay one record per phase
+        self.phases = {}
+        self.profile_phase = profile_phase
+        self.profiler = cProfile.Profile() if profile_phase else None
+    @contextlib.contextmanager
+    def phase(self, name):
+        record = self.phases.setdefault(name, {'calls':0, 'wall_time':0.0})
+        record['calls'] += 1
+        if name == self.profile_phase:
+            self.profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] += time.perf_counter() - started
+            if name == self.profile_phase:
+                self.profiler.disable()
+            record['peak_rss'] = get_peak_rss()
+    def add(self, record, counter, value):
+        record[counter] = record.get(counter, 0) + value
+    def print_profile(self):
+        if self.profiler:
+            print('INFO: Profile of ' + self.profile_phase)
+            pstats.Stats(self.profiler, stream = sys.stdout).sort_stats('cumulative').print_stats(25)
+    def write(self, path):
+        with open(path, 'w') as file_handle:
+            json.dump(self, file_handle, cls=ComplexEncoder, indent = 2)
+    def repr_json(self):
+        return {'phases':self.phases}
+
+class DirListing:
+    __slots__ = ('path', 'mtime_ns', 'files', 'subdirs', 'depth', 'order')
+    def __init__(self, path, mtime_ns, files, subdirs, depth = 0, order = ()):
+        self.path = path
+        # None when the directory can't be listed
+        self.mtime_ns = mtime_ns
+        # None when the directory was reused from known_dirs without listing it
+        self.files = files
+        self.subdirs = subdirs
+        self.depth = depth
+        # Index of the root, then of every subdir down to this one. Sorting by it gives the
+        # top-down order of os.walk whatever order the workers finish in
+        self.order = order
+
+class FileFilter:
+    def __init__(self, wanted = None, include = None, exclude = None, max_depth = None):
+        # wanted holds the (size, extension) of every torrent file, None keeps everything
+        self.wanted = wanted
+        self.wanted_extensions = None if wanted is None else set(x[1] for x in wanted)
+        self.include = include or []
+        self.exclude = exclude or []
+        self.max_depth = max_depth
+    def matches_any(self, path, patterns):
+        name = os.path.basename(path)
+        return any(fnmatch(name, x) or fnmatch(path, x) for x in patterns)
+    def wants_dir(self, path, depth):
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return not self.matches_any(path, self.exclude)
+    def wants_name(self, path):
+        # Checked before stat so unwanted files cost nothing more than their dir entry
+        if self.wanted_extensions is not None and os.path.splitext(path)[1] not in self.wanted_extensions:
+            return False
+        if self.include and not self.matches_any(path, self.include):
+            return False
+        return not self.matches_any(path, self.exclude)
+    def wants_size(self, path, size):
+        return self.wanted is None or (size, os.path.splitext(path)[1]) in self.wanted
+    def wants_dir_path(self, path, roots):
+        # Checks every dir between the root and path, for dirs that weren't reached by a filtered walk
+        depth = get_dir_depth(path, roots)
+        if depth is None:
+            return False
+        while depth > 0:
+            if not self.wants_dir(path, depth):
+                return False
+            path = os.path.dirname(path)
+            depth -= 1
+        return True
+    def wants_file(self, path, size, roots):
+        # Same checks for files coming from the persistent index, which stores everything
+        return self.wants_name(path) and self.wants_size(path, size) and self.wants_dir_path(os.path.dirname(path), roots)
+
+class DirWalker:
+    def __init__(self, workers = 8, known_dirs = None, file_filter = None, index_fields = False):
+        self.workers = workers
+        # path -> (mtime_ns, subdirs) of directories that don't need listing if unchanged
+        self.known_dirs = known_dirs or {}
+        self.file_filter = file_filter
+        # Files are listed as (path, size), plus (mtime_ns, inode) for the persistent index
+        self.index_fields = index_fields
+        self.queues = {}
+        self.results = queue.Queue()
+    def get_queue(self, device):
+        # One queue with its own threads per st_dev so a slow or rotational disk doesn't starve the others
+        if device not in self.queues:
+            dir_queue = queue.Queue()
+            threads_count = get_device_workers(device, self.workers)
+            for x in range(threads_count):
+                threading.Thread(target = self.run_worker, args = (dir_queue,), daemon = True).start()
+            self.queues[device] = (dir_queue, threads_count)
+        return self.queues[device][0]
+    def run_worker(self, dir_queue):
+        while True:
+            item = dir_queue.get()
+            if item is None:
+                return
+            try:
+                self.results.put(self.list_dir(*item))
+            except Exception as e:
+                self.results.put(e)
+    def list_dir(self, path, depth, order = ()):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return DirListing(path, None, None, [], depth, order)
+        file_filter = self.file_filter
+        known = self.known_dirs.get(path)
+        if known and known[0] == stat.st_mtime_ns:
+            return DirListing(path, stat.st_mtime_ns, None, [(x, stat.st_dev) for x in known[1] if not file_filter or file_filter.wants_dir(x, depth + 1)], depth, order)
+        files = []
+        subdirs = []
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            return DirListing(path, None, None, [], depth, order)
+        with entries:
+            for entry in entries:
+                try:
+                    # Subdirs are only recursed when they aren't symlinks, same as os.walk
+                    if entry.is_dir():
+                        if not entry.is_symlink() and (not file_filter or file_filter.wants_dir(entry.path, depth + 1)):
+                            subdirs.append((entry.path, entry.stat().st_dev))
+                        continue
+                    # Checked before stat so unwanted files cost nothing more than their dir entry
+                    if file_filter and not file_filter.wants_name(entry.path):
+                        continue
+                    entry_stat = entry.stat()
+                    if file_filter and not file_filter.wants_size(entry.path, entry_stat.st_size):
+                        continue
+                    if self.index_fields:
+                        files.append((entry.path, entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ino))
+                    else:
+                        files.append((entry.path, entry_stat.st_size))
+                except OSError:
+                    pass
+        return DirListing(path, stat.st_mtime_ns, files, subdirs, depth, order)
+    def walk(self, roots, depth = 0):
+        # Listings are yielded as soon as they are done so only the ones being consumed are kept.
+        # A single worker lists top-down in the calling thread like os.walk, more workers yield
+        # in completion order and only exchange queue items, never futures. listing.order tells
+        # the os.walk position either way
+        # Every dir is listed once, also when a root lies inside another root
+        queued = set()
+        if self.workers <= 1:
+            pending_dirs = []
+            for index, root in reversed(list(enumerate(roots))):
+                if root not in queued:
+                    queued.add(root)
+                    pending_dirs.append((root, depth, (index,)))
+            while pending_dirs:
+                listing = self.list_dir(*pending_dirs.pop())
+                if listing.mtime_ns is not None:
+                    yield listing
+                    for index, (subdir, device) in reversed(list(enumerate(listing.subdirs))):
+                        if subdir not in queued:
+                            queued.add(subdir)
+                            pending_dirs.append((subdir, listing.depth + 1, listing.order + (index,)))
+            return
+        outstanding = 0
+        try:
+            for index, root in enumerate(roots):
+                try:
+                    device = os.stat(root).st_dev
+                except OSError:
+                    continue
+                if root not in queued:
+                    queued.add(root)
+                    self.get_queue(device).put((root, depth, (index,)))
+                    outstanding += 1
+            while outstanding:
+                listing = self.results.get()
+                outstanding -= 1
+                if isinstance(listing, Exception):
+                    raise listing
+                if listing.mtime_ns is None:
+                    continue
+                for index, (subdir, device) in enumerate(listing.subdirs):
+                    if subdir not in queued:
+                        queued.add(subdir)
+                        self.get_queue(device).put((subdir, listing.depth + 1, listing.order + (index,)))
+                        outstanding += 1
+                yield listing
+        finally:
+            for dir_queue, threads_count in self.queues.values():
+                for x in range(threads_count):
+                    dir_queue.put(None)
+            self.queues = {}
+            self.results = queue.Queue()
+
+class PersistentIndex(JSONSerializable):
+    def __init__(self, index_path, rescan = False):
+        self.index_path = index_path
+        self.rescan = rescan
+        self.dirs_reused = 0
+        self.dirs_refreshed = 0
+        self.dirs_removed = 0
+        self.seen_dirs = {}
+        self.dir_orders = {}
+        index_dir = os.path.dirname(index_path)
+        if index_dir and not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_dir ON files (dir)')
+    def load_known_dirs(self):
+        known_dirs = {}
+        subdirs = {}
+        for path, parent, mtime_ns in self.connection.execute('SELECT path, parent, mtime_ns FROM dirs'):
+            known_dirs[path] = (mtime_ns, subdirs.setdefault(path, []))
+            subdirs.setdefault(parent, []).append(path)
+        return known_dirs
+    def walk(self, search_dirs, workers):
+        # Only directories whose mtime changed since the last run are listed again,
+        # files modified in place without touching their directory need --rescan
+        known_dirs = {} if self.rescan else self.load_known_dirs()
+        seen_dirs = self.seen_dirs = {}
+        dir_orders = self.dir_orders = {}
+        with self.connection:
+            for listing in DirWalker(workers, known_dirs, index_fields = True).walk(search_dirs):
+                seen_dirs[listing.path] = (listing.mtime_ns, [x[0] for x in listing.subdirs])
+                dir_orders[listing.path] = listing.order
+                if listing.files is None:
+                    self.dirs_reused += 1
+                    for path, size in self.connection.execute('SELECT path, size FROM files WHERE dir = ?', (listing.path,)):
+                        yield path, size
+                    continue
+                self.dirs_refreshed += 1
+                self.connection.execute('DELETE FROM files WHERE dir = ?', (listing.path,))
+                self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', [(x[0], listing.path, x[1], x[2], x[3]) for x in listing.files])
+                self.connection.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (listing.path, os.path.dirname(listing.path), listing.mtime_ns))
+                for x in listing.files:
+                    yield x[0], x[1]
+            for search_dir in search_dirs:
+                self.remove_missing(search_dir, seen_dirs)
+    def remove_missing(self, search_dir, seen_dirs):
+        prefix = os.path.join(search_dir, '')
+        for (path,) in self.connection.execute('SELECT path FROM dirs').fetchall():
+            if (path == search_dir or path.startswith(prefix)) and path not in seen_dirs:
+                self.connection.execute('DELETE FROM files WHERE dir = ?', (path,))
+                self.connection.execute('DELETE FROM dirs WHERE path = ?', (path,))
+                self.dirs_removed += 1
+    def close(self):
+        self.connection.close()
+    def get_stats(self):
+        return 'Index: ' + str(self.dirs_reused) + ' directories reused, ' + str(self.dirs_refreshed) + ' refreshed, ' + str(self.dirs_removed) + ' removed'
+    def repr_json(self):
+        return {'index_path':self.index_path, 'rescan':self.rescan, 'dirs_reused':self.dirs_reused, 'dirs_refreshed':self.dirs_refreshed, 'dirs_removed':self.dirs_removed}
+
+class SearchDir(JSONSerializable):
+    def __init__(self, search_dirs, spill_to_disk = False, persistent_index = None, scan_workers = 8, file_filter = None):
+        self.search_dirs = search_dirs
+        self.scan_workers = scan_workers
+        self.file_filter = file_filter
+        self.persistent_index = persistent_index
+        # Columnar file table: parent dir id, name (or its tempfile offset), size and
+        # interned extension code per file, lookups follow MyFile.__eq__
+        self.dirs = []
+        self.dir_ids = {}
+        self.extension_codes = {}
+        self.file_dirs = array('I')
+        self.file_sizes = array('Q')
+        self.file_extensions = array('I')
+        self.files_count = 0
+        self.total_size = 0
+        # path -> (mtime_ns, subdirs) of every listed dir, kept for refresh_dirs
+        self.listed_dirs = {}
+        # path -> DirListing.order of every listed dir, candidates are returned in this order
+        self.dir_orders = {}
+        self.deleted_rows = set()
+        self.tempfile = None
+        if spill_to_disk:
+            self.tempfile = tempfile.NamedTemporaryFile(prefix = 'pam', mode = "w+b")
+            self.file_names = array('Q')
+        else:
+            self.file_names = []
+        self.sorted_order = None
+        self.sorted_count = 0
+        self.create_cache()
+    def add_file(self, path, size):
+        directory, name = os.path.split(path)
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        if self.tempfile:
+            self.tempfile.seek(0, 2)
+            self.file_names.append(self.tempfile.tell())
+            self.tempfile.write(json.dumps(name).encode('utf-8') + b'\n')
+        else:
+            self.file_names.append(name)
+        self.file_dirs.append(dir_id)
+        self.file_sizes.append(size)
+        self.file_extensions.append(self.extension_codes.setdefault(os.path.splitext(name)[1], len(self.extension_codes)))
+        self.files_count += 1
+        self.total_size += size
+    def remove_dir_files(self, path):
+        dir_id = self.dir_ids.get(path)
+        if dir_id is None:
+            return
+        rows = numpy.flatnonzero(numpy.array(self.file_dirs, dtype = self.file_dirs.typecode) == dir_id).tolist()
+        rows = [x for x in rows if x not in self.deleted_rows]
+        self.deleted_rows.update(rows)
+        self.files_count -= len(rows)
+        self.total_size -= sum(self.file_sizes[x] for x in rows)
+    def remove_dir(self, path):
+        # Drops a dir and everything listed below it, returns the removed dirs
+        removed = []
+        pending_dirs = [path]
+        while pending_dirs:
+            path = pending_dirs.pop()
+            listed = self.listed_dirs.pop(path, None)
+            self.dir_orders.pop(path, None)
+            if listed is None:
+                continue
+            self.remove_dir_files(path)
+            removed.append(path)
+            pending_dirs.extend(listed[1])
+        return removed
+    def refresh_dirs(self, paths, watch = None):
+        # Lists changed dirs again, walks the new subdirs and drops the vanished ones,
+        # returns the (added, removed) dirs. watch is called on every new dir before it is
+        # listed, so files created right after the listing still produce an event
+        added = []
+        removed = []
+        walker = DirWalker(1, file_filter = self.file_filter)
+        for path in paths:
+            listed = self.listed_dirs.get(path)
+            if listed is None:
+                continue
+            depth = get_dir_depth(path, self.search_dirs)
+            listing = walker.list_dir(path, depth, self.dir_orders.get(path, ()))
+            if listing.mtime_ns is None:
+                removed.extend(self.remove_dir(path))
+                continue
+            self.remove_dir_files(path)
+            for x in listing.files:
+                self.add_file(x[0], x[1])
+            subdirs = [x[0] for x in listing.subdirs]
+            self.listed_dirs[path] = (listing.mtime_ns, subdirs)
+            for subdir in set(listed[1]) - set(subdirs):
+                removed.extend(self.remove_dir(subdir))
+            new_subdirs = [(x, depth + 1, listing.order + (index,)) for index, x in enumerate(subdirs) if x not in self.listed_dirs]
+            while new_subdirs:
+                subdir, subdir_depth, subdir_order = new_subdirs.pop()
+                if watch:
+                    watch(subdir)
+                new_listing = walker.list_dir(subdir, subdir_depth, subdir_order)
+                if new_listing.mtime_ns is None:
+                    continue
+                self.add_listing(new_listing)
+                added.append(subdir)
+                new_subdirs.extend((x[0], subdir_depth + 1, subdir_order + (index,)) for index, x in enumerate(new_listing.subdirs) if x[0] not in self.listed_dirs)
+        return added, removed
+    def get_file(self, row):
+        if self.tempfile:
+            self.tempfile.seek(self.file_names[row], 0)
+            name = json.loads(self.tempfile.readline().decode('utf-8'))
+        else:
+            name = self.file_names[row]
+        return FileInDisk(path = os.path.join(self.dirs[self.file_dirs[row]], name), size = self.file_sizes[row])
+    def compact(self):
+        rows = numpy.setdiff1d(numpy.arange(len(self.file_sizes)), numpy.array(sorted(self.deleted_rows), dtype = numpy.int64))
+        self.file_dirs = compact_column(self.file_dirs, rows)
+        self.file_sizes = compact_column(self.file_sizes, rows)
+        self.file_extensions = compact_column(self.file_extensions, rows)
+        if self.tempfile:
+            self.file_names = compact_column(self.file_names, rows)
+        else:
+            self.file_names = [self.file_names[x] for x in rows.tolist()]
+        self.deleted_rows = set()
+    def sort_files(self):
+        # Stable sort so files of the same size keep the scan order. Rows added by
+        # refresh_dirs are searched linearly until there are enough to sort again
+        if self.sorted_order is not None and len(self.file_sizes) - self.sorted_count <= max(4096, self.sorted_count // 8):
+            return
+        if self.deleted_rows:
+            self.compact()
+        sizes = numpy.array(self.file_sizes, dtype = numpy.uint64)
+        self.sorted_order = numpy.argsort(sizes, kind = 'stable')
+        self.sorted_sizes = sizes[self.sorted_order]
+        self.sorted_extensions = numpy.array(self.file_extensions, dtype = numpy.uint32)[self.sorted_order]
+        self.sorted_count = len(sizes)
+    def search_files(self, files_to_search):
+        # The sizes of every file are located in the sorted size column at once,
+        # then the candidates are filtered on their extension code
+        self.sort_files()
+        sizes = numpy.array([x.size for x in files_to_search], dtype = numpy.uint64)
+        starts = numpy.searchsorted(self.sorted_sizes, sizes, 'left')
+        ends = numpy.searchsorted(self.sorted_sizes, sizes, 'right')
+        unsorted_sizes = numpy.array(self.file_sizes[self.sorted_count:], dtype = numpy.uint64)
+        unsorted_extensions = numpy.array(self.file_extensions[self.sorted_count:], dtype = numpy.uint32)
+        for file_to_search, start, end, size in zip(files_to_search, starts, ends, sizes):
+            extension_code = self.extension_codes.get(file_to_search.get_extension())
+            if extension_code is None:
+                continue
+            rows = self.sorted_order[start:end][self.sorted_extensions[start:end] == extension_code]
+            if len(unsorted_sizes):
+                rows = numpy.concatenate([rows, numpy.flatnonzero((unsorted_sizes == size) & (unsorted_extensions == extension_code)) + self.sorted_count])
+            rows = [x for x in rows.tolist() if x not in self.deleted_rows]
+            if len(rows) > 1:
+                # Walk position, then listing order inside a dir, so the [n] numbering and
+                # fuzzy ties don't depend on which scan worker finished first
+                rows.sort(key = lambda x: (self.dir_orders.get(self.dirs[self.file_dirs[x]], ()), x))
+            for row in rows:
+                file_to_search.matches.append(self.get_file(row))
+    def search_file(self, file_to_search):
+        self.search_files([file_to_search])
+    def add_listing(self, listing):
+        self.listed_dirs[listing.path] = (listing.mtime_ns, [x[0] for x in listing.subdirs])
+        self.dir_orders[listing.path] = listing.order
+        for x in listing.files:
+            self.add_file(x[0], x[1])
+    def create_cache(self):
+        if self.persistent_index:
+            for path, size in self.persistent_index.walk(self.search_dirs, self.scan_workers):
+                if not self.file_filter or self.file_filter.wants_file(path, size, self.search_dirs):
+                    self.add_file(path, size)
+            self.listed_dirs = dict((path, listed) for path, listed in self.persistent_index.seen_dirs.items() if not self.file_filter or self.file_filter.wants_dir_path(path, self.search_dirs))
+            self.dir_orders = dict((path, self.persistent_index.dir_orders[path]) for path in self.listed_dirs)
+            return
+        for listing in DirWalker(self.scan_workers, file_filter = self.file_filter).walk(self.search_dirs):
+            self.add_listing(listing)
+    def close(self):
+        if self.tempfile:
+            self.tempfile.close()
+    def repr_json(self):
+        return {'search_dirs':self.search_dirs, 'scan_workers':self.scan_workers, 'persistent_index':self.persistent_index, 'files_count':self.files_count, 'dirs_count':len(self.dirs), 'extensions_count':len(self.extension_codes), 'tempfile':self.tempfile.name if self.tempfile else None}
+
+class ReverseIndex(JSONSerializable):
+    # Every file of many torrents keyed by (length, extension) in sorted columns, tells how
+    # much of each torrent a library can serve without matching the torrents one by one
+    CHUNK_SIZE = 65536
+    def __init__(self):
+        self.torrents = []
+        self.extension_codes = {}
+        self.torrent_ids = array('I')
+        self.file_sizes = array('Q')
+        self.file_extensions = array('I')
+        # (size, extension) of every file, for the FileFilter of the library scan
+        self.wanted = set()
+        self.library_files_count = 0
+    def add_torrent(self, label, info):
+        torrent_id = len(self.torrents)
+        for file_in_torrent in get_info_files(info)[0]:
+            extension = file_in_torrent.get_extension()
+            self.torrent_ids.append(torrent_id)
+            self.file_sizes.append(file_in_torrent.size)
+            self.file_extensions.append(self.extension_codes.setdefault(extension, len(self.extension_codes)))
+            self.wanted.add((file_in_torrent.size, extension))
+        self.torrents.append((label, info['name']))
+    def get_keys(self, sizes, extensions):
+        # size and extension code packed in one uint64 so a single searchsorted finds both
+        return numpy.array(sizes, dtype = numpy.uint64) * self.extensions_count + numpy.array(extensions, dtype = numpy.uint64)
+    def build(self):
+        self.extensions_count = numpy.uint64(len(self.extension_codes) + 1)
+        if self.file_sizes and max(self.file_sizes) >= (2 ** 64 - 1) // int(self.extensions_count):
+            raise ValueError('a file of ' + format_size(max(self.file_sizes)) + ' is too big for the reverse index')
+        self.torrent_rows = numpy.array(self.torrent_ids, dtype = numpy.int64)
+        self.sizes = numpy.array(self.file_sizes, dtype = numpy.float64)
+        self.keys, self.key_rows = numpy.unique(self.get_keys(self.file_sizes, self.file_extensions), return_inverse = True)
+        self.key_rows = self.key_rows.reshape(-1)
+        # Library files seen per key. The nth file of a torrent with a key is covered once
+        # the library has more than n files with it, so two same size .srt need two files
+        self.key_counts = numpy.zeros(len(self.keys), dtype = numpy.int64)
+        order = numpy.lexsort((self.key_rows, self.torrent_rows))
+        group_starts = numpy.ones(len(order), dtype = bool)
+        group_starts[1:] = (self.torrent_rows[order][1:] != self.torrent_rows[order][:-1]) | (self.key_rows[order][1:] != self.key_rows[order][:-1])
+        positions = numpy.arange(len(order))
+        self.key_ranks = numpy.empty(len(order), dtype = numpy.int64)
+        self.key_ranks[order] = positions - numpy.maximum.accumulate(numpy.where(group_starts, positions, 0))
+        self.torrent_sizes = numpy.bincount(self.torrent_rows, weights = self.sizes, minlength = len(self.torrents))
+        self.torrent_files_counts = numpy.bincount(self.torrent_rows, minlength = len(self.torrents))
+        self.reported = numpy.zeros(len(self.torrents), dtype = bool)
+    def add_files(self, files):
+        # Counts the keys of a chunk of (path, size) library files
+        codes = [self.extension_codes.get(os.path.splitext(x[0])[1]) for x in files]
+        rows = [x for x in range(len(files)) if codes[x] is not None]
+        self.library_files_count += len(files)
+        if not rows or not len(self.keys):
+            return
+        keys = self.get_keys([files[x][1] for x in rows], [codes[x] for x in rows])
+        positions = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        self.key_counts += numpy.bincount(positions[self.keys[positions] == keys], minlength = len(self.keys))
+    def get_coverage(self):
+        # (files covered, bytes covered) per torrent
+        covered = self.key_counts[self.key_rows] > self.key_ranks
+        return numpy.bincount(self.torrent_rows, weights = covered, minlength = len(self.torrents)), numpy.bincount(self.torrent_rows, weights = covered * self.sizes, minlength = len(self.torrents))
+    def pop_complete(self):
+        # Torrents fully covered since the last call
+        files_covered = self.get_coverage()[0]
+        complete = numpy.flatnonzero((files_covered == self.torrent_files_counts) & ~self.reported)
+        self.reported[complete] = True
+        return complete.tolist()
+    def get_ranking(self, min_coverage = 0):
+        # (torrent id, files covered, bytes covered) by bytes covered, most first
+        files_covered, bytes_covered = self.get_coverage()
+        ranking = []
+        for torrent_id in numpy.argsort(-bytes_covered, kind = 'stable').tolist():
+            if bytes_covered[torrent_id] > 0 and bytes_covered[torrent_id] >= self.torrent_sizes[torrent_id] * min_coverage / 100:
+                ranking.append((torrent_id, int(files_covered[torrent_id]), int(bytes_covered[torrent_id])))
+        return ranking
+    def describe(self, torrent_id, files_covered = None, bytes_covered = None):
+        label, name = self.torrents[torrent_id]
+        files_count = int(self.torrent_files_counts[torrent_id])
+        total_size = int(self.torrent_sizes[torrent_id])
+        if files_covered is None:
+            return label + ' ' + name + ': ' + str(files_count) + ' files, ' + format_size(total_size)
+        return '{:5.1f}'.format(bytes_covered * 100 / max(total_size, 1)) + '% ' + label + ' ' + name + ': ' + str(files_covered) + '/' + str(files_count) + ' files, ' + format_size(bytes_covered) + '/' + format_size(total_size)
+    def repr_json(self):
+        return {'torrents_count':len(self.torrents), 'files_count':len(self.file_sizes), 'keys_count':len(self.keys) if hasattr(self, 'keys') else None, 'library_files_count':self.library_files_count}
+
+class InotifyWatcher:
+    # inotify through libc, events only tell which watched dir changed
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    EVENT_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.paths = {}
+        self.wds = {}
+    def watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.EVENT_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.paths[wd] = path
+        self.wds[path] = wd
+    def unwatch(self, path):
+        wd = self.wds.pop(path, None)
+        if wd is not None and self.paths.get(wd) == path:
+            del self.paths[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+    def read_events(self, timeout):
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, name_length = struct.unpack_from('iIII', data, pos)
+                pos += 16 + name_length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were dropped, every watched dir has to be listed again
+                    changed.update(self.wds)
+                path = self.paths.get(wd)
+                if path is None:
+                    continue
+                changed.add(path)
+                if mask & self.IN_IGNORED:
+                    del self.paths[wd]
+                    if self.wds.get(path) == wd:
+                        del self.wds[path]
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    # Compares dir mtimes, files modified in place without touching their dir aren't seen
+    def __init__(self):
+        self.mtimes = {}
+    def watch(self, path):
+        try:
+            self.mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    def unwatch(self, path):
+        self.mtimes.pop(path, None)
+    def read_events(self, timeout):
+        time.sleep(timeout)
+        changed = set()
+        for path, mtime_ns in list(self.mtimes.items()):
+            try:
+                current_mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                current_mtime_ns = None
+            if current_mtime_ns != mtime_ns:
+                changed.add(path)
+                if current_mtime_ns is None:
+                    del self.mtimes[path]
+                else:
+                    self.mtimes[path] = current_mtime_ns
+        return changed
+    def close(self):
+        pass
+
+def import_dependency(name, package):
+    # Imported on first use, so callers that never score fuzzy matches or check for
+    # qBittorrent don't pay for rapidfuzz or psutil
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise MissingDependencyError('The ' + package + ' module is needed, you can install it with this command: python -m pip install ' + package)
+
+def is_sha1_hash(value):
+    if len(value) != 40:
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
+
+def list_bt_backup_hashes(bt_backup):
+    hashes = []
+    for filename in sorted(os.listdir(bt_backup)):
+        hash, extension = os.path.splitext(filename)
+        if extension == '.torrent' and is_sha1_hash(hash):
+            hashes.append(hash)
+    return hashes
+
+def read_hashes_file(path):
+    hashes = []
+    with open(path, 'r') as file_handle:
+        for line in file_handle:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if not is_sha1_hash(line):
+                raise QbitAutomatchError('"' + line + '" in "' + path + '" is not a valid hash')
+            hashes.append(line.lower())
+    return hashes
+
+def solve_assignment(cost):
+    # Hungarian algorithm for a rows x columns cost matrix with rows <= columns,
+    # returns the column assigned to each row
+    rows_count = len(cost)
+    columns_count = len(cost[0])
+    u = [0] * (rows_count + 1)
+    v = [0] * (columns_count + 1)
+    owner = [0] * (columns_count + 1)
+    way = [0] * (columns_count + 1)
+    for row in range(1, rows_count + 1):
+        owner[0] = row
+        column = 0
+        min_values = [float('inf')] * (columns_count + 1)
+        used = [False] * (columns_count + 1)
+        while True:
+            used[column] = True
+            current_row = owner[column]
+            delta = float('inf')
+            next_column = 0
+            for j in range(1, columns_count + 1):
+                if not used[j]:
+                    reduced = cost[current_row - 1][j - 1] - u[current_row] - v[j]
+                    if reduced < min_values[j]:
+                        min_values[j] = reduced
+                        way[j] = column
+                    if min_values[j] < delta:
+                        delta = min_values[j]
+                        next_column = j
+            for j in range(columns_count + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_values[j] -= delta
+            column = next_column
+            if owner[column] == 0:
+                break
+        while column:
+            previous_column = way[column]
+            owner[column] = owner[previous_column]
+            column = previous_column
+    solution = [None] * rows_count
+    for column in range(1, columns_count + 1):
+        if owner[column]:
+            solution[owner[column] - 1] = column - 1
+    return solution
+
+def create_watcher(paths, interval):
+    # inotify on Linux, polling everywhere else or when inotify runs out of watches
+    if sys.platform == "linux":
+        try:
+            watcher = InotifyWatcher()
+            try:
+                for path in paths:
+                    watcher.watch(path)
+                return watcher
+            except OSError:
+                watcher.close()
+                raise
+        except (OSError, AttributeError) as e:
+            print('INFO: inotify unavailable (' + str(e) + '), polling every ' + str(interval) + 's instead')
+    watcher = PollingWatcher()
+    for path in paths:
+        watcher.watch(path)
+    return watcher
+
+def paths_overlap(path, other_path):
+    return path == other_path or path.startswith(other_path + '/') or other_path.startswith(path + '/')
+
+def plan_renames(current_paths, target_paths):
+    # Web API paths use /. Returns the folder renames in the order they must run and the
+    # (old, new) file renames left once they are done, split in waves (see order_renames)
+    current_paths = list(current_paths)
+    folder_renames = []
+    while True:
+        folders = {}
+        for index, current_path in enumerate(current_paths):
+            parts = current_path.split('/')
+            for depth in range(1, len(parts)):
+                folders.setdefault('/'.join(parts[:depth]), []).append(index)
+        # Every (folder, new folder) pair that would move a file to its target
+        candidates = set()
+        for current_path, target_path in zip(current_paths, target_paths):
+            if current_path == target_path:
+                continue
+            current_parts = current_path.split('/')
+            target_parts = target_path.split('/')
+            depth = 1
+            while depth < len(current_parts) and depth < len(target_parts) and current_parts[-depth] == target_parts[-depth]:
+                candidates.add(('/'.join(current_parts[:-depth]), '/'.join(target_parts[:-depth])))
+                depth += 1
+        # Topmost first, a folder can be renamed when every file below it lands on its
+        # target and the new folder doesn't exist yet
+        applied = []
+        existing_paths = set(current_paths)
+        for old_path, new_path in sorted(candidates, key = lambda x: (x[0].count('/'), x)):
+            if new_path in folders or new_path in existing_paths or paths_overlap(old_path, new_path):
+                continue
+            if any(paths_overlap(old_path, x[0]) or paths_overlap(new_path, x[1]) for x in applied):
+                continue
+            if all(target_paths[x] == new_path + current_paths[x][len(old_path):] for x in folders[old_path]):
+                applied.append((old_path, new_path))
+        if not applied:
+            break
+        for old_path, new_path in applied:
+            for index in folders[old_path]:
+                current_paths[index] = new_path + current_paths[index][len(old_path):]
+        folder_renames.extend(applied)
+    file_renames = [(x, y) for x, y in zip(current_paths, target_paths) if x != y]
+    return folder_renames, order_renames(current_paths, file_renames)
+
+def order_renames(current_paths, renames):
+    # Splits renames in waves that can each run in parallel. A rename waits until no file
+    # has its new path anymore, so chains run from their end, and every cycle (a swap)
+    # is broken by moving one of its files to a temporary name first
+    occupied = set(current_paths)
+    pending = list(renames)
+    waves = []
+    while pending:
+        wave = [x for x in pending if x[1] not in occupied]
+        if not wave:
+            # Every new path belongs to another pending rename, following them from any
+            # rename ends in a cycle
+            indexes = dict((x[0], index) for index, x in enumerate(pending))
+            index = 0
+            visited = set()
+            while index not in visited:
+                visited.add(index)
+                if pending[index][1] not in indexes:
+                    raise ValueError('"' + pending[index][1] + '" is the new path of a file but another file keeps it')
+                index = indexes[pending[index][1]]
+            old_path, new_path = pending[index]
+            temp_path = old_path + '.qbit_automatch'
+            while temp_path in occupied:
+                temp_path += '_'
+            wave = [(old_path, temp_path)]
+            pending[index] = (temp_path, new_path)
+        else:
+            pending = [x for x in pending if x[1] in occupied]
+        for old_path, new_path in wave:
+            occupied.discard(old_path)
+            occupied.add(new_path)
+        waves.append(wave)
+    return waves
+
+def iter_search_files(search_dirs, persistent_index = None, scan_workers = 8, file_filter = None):
+    # (path, size) of every wanted file below search_dirs, same sources as SearchDir.create_cache
+    if persistent_index:
+        for path, size in persistent_index.walk(search_dirs, scan_workers):
+            if not file_filter or file_filter.wants_file(path, size, search_dirs):
+                yield path, size
+        return
+    for listing in DirWalker(scan_workers, file_filter = file_filter).walk(search_dirs):
+        yield from listing.files
+
+def get_dir_depth(path, roots):
+    # Dirs between the first root holding path and path, None when no root does
+    for root in roots:
+        if path == root:
+            return 0
+        if path.startswith(os.path.join(root, '')):
+            return len(os.path.relpath(path, root).split(os.sep))
+    return None
+
+def compact_column(column, rows):
+    return array(column.typecode, numpy.array(column, dtype = column.typecode)[rows].tobytes())
+
+def decode_string(value):
+    # Same as bencode.py, byte strings that are valid utf-8 become str
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value
+
+def read_file_tree(reader, pos, path = None):
+    # Flattens a v2 file tree in its sorted order, which is the file order of the torrent.
+    # pieces root stays raw bytes, decode would turn roots that happen to be utf-8 into str
+    files = []
+    for key, key_pos, value_pos, value_end in reader.dict_items(pos):
+        if key != b'':
+            files.extend(read_file_tree(reader, value_pos, (path or []) + [decode_string(key)]))
+            continue
+        entry = {'path':path, 'length':0, 'pieces root':None}
+        for leaf_key, leaf_key_pos, leaf_pos, leaf_end in reader.dict_items(value_pos):
+            if leaf_key == b'length':
+                entry['length'] = reader.decode(leaf_pos)[0]
+            elif leaf_key == b'pieces root':
+                start, end = reader.string_span(leaf_pos)
+                entry['pieces root'] = bytes(reader.data[start:end])
+        files.append(entry)
+    return files
+
+def read_torrent_info(path):
+    # Decodes only the info keys needed for matching, pieces and the v2 piece layers
+    # next to info are returned as their (start, end) byte range instead of being copied
+    info = {}
+    with open(path, 'rb') as file_handle, mmap.mmap(file_handle.fileno(), 0, access = mmap.ACCESS_READ) as torrent_data:
+        reader = BencodeReader(torrent_data)
+        for key, key_pos, value_pos, value_end in reader.dict_items(0):
+            if key == b'piece layers':
+                info['piece layers'] = (value_pos, value_end)
+            if key != b'info':
+                continue
+            for info_key, info_key_pos, info_pos, info_end in reader.dict_items(value_pos):
+                if info_key == b'pieces':
+                    info['pieces'] = reader.string_span(info_pos)
+                elif info_key == b'file tree':
+                    info['file tree'] = read_file_tree(reader, info_pos)
+                elif info_key in [b'name', b'piece length', b'length', b'files']:
+                    info[info_key.decode('utf-8')] = reader.decode(info_pos)[0]
+    return info
+
+def get_info_files(info):
+    # Returns the real files of a v1, hybrid or v2 info dict, how many files the libtorrent
+    # storage has and its total size, both counting pad files. v1 pad files (BEP 47) are
+    # skipped, v2 only torrents get the pad file libtorrent adds after every file but the
+    # last that doesn't end on a piece boundary
+    piece_length = int(info['piece length'])
+    file_tree = info.get('file tree', [])
+    pieces_roots = dict((os.sep.join(x['path']), x['pieces root']) for x in file_tree)
+    if 'files' in info:
+        entries = [(x['path'], int(x['length']), 'p' in x.get('attr', '')) for x in info['files']]
+    elif 'length' in info:
+        entries = [(info['name'], int(info['length']), False)]
+    else:
+        entries = []
+        for position, x in enumerate(file_tree):
+            entries.append((x['path'], int(x['length']), False))
+            if position < len(file_tree) - 1 and x['length'] % piece_length:
+                entries.append((None, piece_length - x['length'] % piece_length, True))
+    files = []
+    offset = 0
+    for index, (path, length, pad) in enumerate(entries):
+        if not pad:
+            file_in_torrent = FileInTorrent(path, length, offset, index)
+            file_in_torrent.pieces_root = pieces_roots.get(file_in_torrent.path)
+            files.append(file_in_torrent)
+        offset += length
+    return files, len(entries), offset
+
+def merkle_root(hashes, leaves_count, pad = bytes(32)):
+    # Root of the smallest power of two tree holding leaves_count leaves, the ones hashes
+    # doesn't give are pad. Subtrees are combined as soon as they are complete so only
+    # one hash per level is kept while streaming
+    levels = (leaves_count - 1).bit_length()
+    pads = [pad]
+    for level in range(levels):
+        pads.append(hashlib.sha256(pads[-1] * 2).digest())
+    stack = []
+    for node in hashes:
+        level = 0
+        while stack and stack[-1][0] == level:
+            node = hashlib.sha256(stack.pop()[1] + node).digest()
+            level += 1
+        stack.append((level, node))
+    if not stack:
+        return pads[levels]
+    while len(stack) > 1 or stack[0][0] < levels:
+        level, node = stack.pop()
+        node = hashlib.sha256(node + pads[level]).digest()
+        level += 1
+        while stack and stack[-1][0] == level:
+            node = hashlib.sha256(stack.pop()[1] + node).digest()
+            level += 1
+        stack.append((level, node))
+    return stack[0][1]
+
+def iter_block_hashes(file_view, start, end):
+    for block_start in range(start, end, MERKLE_BLOCK_SIZE):
+        yield hashlib.sha256(file_view[block_start:min(block_start + MERKLE_BLOCK_SIZE, end)]).digest()
+
+def verify_merkle_root(path, size, pieces_root, piece_length, piece_layer = None):
+    # Streams the file in 16 KiB blocks. With the piece layer every piece is compared as soon
+    # as it is hashed, first and last piece first, so a wrong candidate stops early
+    try:
+        with open(path, 'rb') as file_handle:
+            if os.fstat(file_handle.fileno()).st_size != size:
+                return False
+            with mmap.mmap(file_handle.fileno(), 0, access = mmap.ACCESS_READ) as file_map:
+                file_view = memoryview(file_map)
+                try:
+                    if piece_layer is None:
+                        return merkle_root(iter_block_hashes(file_view, 0, size), -(-size // MERKLE_BLOCK_SIZE)) == pieces_root
+                    pieces_count = len(piece_layer) // 32
+                    order = list(range(pieces_count))
+                    if pieces_count > 2:
+                        order = [0, pieces_count - 1] + order[1:-1]
+                    for piece_index in order:
+                        piece_start = piece_index * piece_length
+                        piece_hash = merkle_root(iter_block_hashes(file_view, piece_start, min(piece_start + piece_length, size)), piece_length // MERKLE_BLOCK_SIZE)
+                        if piece_hash != piece_layer[piece_index * 32:piece_index * 32 + 32]:
+                            return False
+                finally:
+                    file_view.release()
+    except (OSError, ValueError):
+        return False
+    return True
+
+def splice_bencoded_dict(data, updates):
+    # Re-encodes only the updated top level keys and copies every other byte range
+    # verbatim, returns None when every updated value is already the same
+    reader = BencodeReader(data)
+    data_view = memoryview(data)
+    bencode = import_dependency('bencode', 'bencode.py')
+    pending = sorted((key.encode('utf-8'), bencode.encode(value)) for key, value in updates.items())
+    chunks = []
+    copied_until = 0
+    dict_end = 1
+    changed = False
+    try:
+        for key, key_pos, value_pos, value_end in reader.dict_items(0):
+            while pending and pending[0][0] < key:
+                new_key, new_value = pending.pop(0)
+                chunks.extend([data_view[copied_until:key_pos], bencode.encode(new_key), new_value])
+                copied_until = key_pos
+                changed = True
+            if pending and pending[0][0] == key:
+                new_value = pending.pop(0)[1]
+                if data_view[value_pos:value_end] != new_value:
+                    chunks.extend([data_view[copied_until:value_pos], new_value])
+                    copied_until = value_end
+                    changed = True
+            dict_end = value_end
+        for new_key, new_value in pending:
+            chunks.extend([data_view[copied_until:dict_end], bencode.encode(new_key), new_value])
+            copied_until = dict_end
+            changed = True
+        chunks.append(data_view[copied_until:])
+        return b''.join(chunks) if changed else None
+    finally:
+        chunks = None
+        data_view.release()
+
+def get_dict_values(data):
+    # Raw bencoded value of every top level key
+    reader = BencodeReader(data)
+    return dict((key, bytes(data[value_pos:value_end])) for key, key_pos, value_pos, value_end in reader.dict_items(0))
+
+def describe_pieces(value):
+    if value is None:
+        return 'none'
+    start, end = BencodeReader(value).string_span(0)
+    return str(sum(x & 1 for x in value[start:end])) + '/' + str(end - start) + ' pieces'
+
+def diff_bencoded_dicts(data, updated_data):
+    # One line per changed top level key, lists one line per changed item
+    values = get_dict_values(data)
+    updated_values = get_dict_values(updated_data)
+    lines = []
+    for key in sorted(set(values) | set(updated_values)):
+        value = values.get(key)
+        updated_value = updated_values.get(key)
+        if value == updated_value:
+            continue
+        name = key.decode('utf-8', 'replace')
+        if key == b'pieces':
+            lines.append(name + ': ' + describe_pieces(value) + ' -> ' + describe_pieces(updated_value))
+            continue
+        value = None if value is None else BencodeReader(value).decode(0)[0]
+        updated_value = None if updated_value is None else BencodeReader(updated_value).decode(0)[0]
+        if isinstance(value, list) or isinstance(updated_value, list):
+            value = value if isinstance(value, list) else []
+            updated_value = updated_value if isinstance(updated_value, list) else []
+            for index in range(max(len(value), len(updated_value))):
+                item = value[index] if index < len(value) else None
+                updated_item = updated_value[index] if index < len(updated_value) else None
+                if item != updated_item:
+                    lines.append(name + '[' + str(index) + ']: ' + repr(item) + ' -> ' + repr(updated_item))
+        else:
+            lines.append(name + ': ' + repr(value) + ' -> ' + repr(updated_value))
+    return lines
+
+def reflink_file(path, link_path):
+    # FICLONE shares the extents of path, it works across btrfs subvolumes and on XFS but
+    # not across filesystems
+    if sys.platform != "linux":
+        raise OSError(errno.EXDEV, 'Not on the same device and reflinks need Linux', link_path)
+    import fcntl
+    fd, temp_path = tempfile.mkstemp(prefix = os.path.basename(link_path) + '.', suffix = '.tmp', dir = os.path.dirname(link_path))
+    try:
+        with open(path, 'rb') as file_handle:
+            fcntl.ioctl(fd, FICLONE, file_handle.fileno())
+        # mkstemp creates the clone as 0600 owned by us, a qBittorrent service user couldn't read it
+        copy_metadata(fd, path)
+        os.close(fd)
+        fd = None
+        os.link(temp_path, link_path)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        os.remove(temp_path)
+
+def link_file(path, link_path):
+    # Returns how link_path was made, an existing link_path must already be path
+    if os.path.lexists(link_path):
+        if os.path.samefile(path, link_path):
+            return 'already linked'
+        raise OSError(errno.EEXIST, 'Another file already exists at "' + link_path + '"', link_path)
+    try:
+        os.link(path, link_path)
+        return 'hardlinked'
+    except OSError as e:
+        if e.errno not in [errno.EXDEV, errno.EPERM]:
+            raise
+    try:
+        reflink_file(path, link_path)
+    except OSError as e:
+        raise OSError(errno.EXDEV, 'Hardlink impossible and reflink failed (' + (e.strerror or str(e)) + ')', link_path)
+    return 'reflinked'
+
+def fsync_dir(path):
+    # Makes renames inside path durable, directories can't be opened on Windows
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomic(path, data, sync_dir = True, metadata_path = None):
+    # Readers see either the old or the new file, never a partly written one. The new file
+    # gets the mode and owner of metadata_path, path itself by default, since mkstemp
+    # creates it as 0600 and qBittorrent may run as another user or group
+    fd, temp_path = tempfile.mkstemp(prefix = os.path.basename(path) + '.', suffix = '.tmp', dir = os.path.dirname(path))
+    try:
+        copy_metadata(fd, metadata_path or path)
+        with os.fdopen(fd, 'wb') as file_handle:
+            file_handle.write(data)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    if sync_dir:
+        fsync_dir(os.path.dirname(path))
+
+def copy_metadata(fd, path):
+    try:
+        stat = os.stat(path)
+        mode = stat.st_mode & 0o7777
+    except FileNotFoundError:
+        # New files get the mode open() would have given them
+        stat = None
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    if os.chmod in os.supports_fd:
+        os.chmod(fd, mode)
+    if stat is not None and hasattr(os, 'fchown'):
+        # Only root can give a file away, other users keep what they are allowed to
+        with contextlib.suppress(PermissionError):
+            os.fchown(fd, stat.st_uid, stat.st_gid)
+
+def link_or_write(path, link_path, data):
+    # A hardlink keeps the original inode alive once path is replaced, filesystems
+    # without hardlinks get a copy of data instead
+    try:
+        os.link(path, link_path)
+    except OSError:
+        write_atomic(link_path, data, sync_dir = False, metadata_path = path)
+
+def read_manifest(journal_path):
+    try:
+        with open(os.path.join(journal_path, 'manifest.json'), 'r') as file_handle:
+            return json.load(file_handle)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(journal_path, manifest):
+    write_atomic(os.path.join(journal_path, 'manifest.json'), json.dumps(manifest, indent = 2).encode('utf-8'))
+
+def hash_piece_range(segments, piece_length, total_size, pieces, first_piece, last_piece):
+    offsets = [x[1] for x in segments]
+    file_handles = {}
+    bitfield = bytearray()
+    try:
+        for piece_index in range(first_piece, last_piece):
+            piece_start = piece_index * piece_length
+            piece_end = min(piece_start + piece_length, total_size)
+            piece_hash = hashlib.sha1()
+            complete = True
+            hashed_until = piece_start
+            segment_index = max(0, bisect.bisect_right(offsets, piece_start) - 1)
+            while complete and segment_index < len(segments) and segments[segment_index][1] < piece_end:
+                path, offset, size = segments[segment_index]
+                read_start = max(piece_start, offset)
+                read_end = min(piece_end, offset + size)
+                segment_index += 1
+                if read_start >= read_end:
+                    continue
+                # Gaps between files are pad files, which are all zeros
+                piece_hash.update(bytes(read_start - hashed_until))
+                hashed_until = read_end
+                try:
+                    if path not in file_handles:
+                        file_handles[path] = open(path, 'rb')
+                    file_handles[path].seek(read_start - offset)
+                    data = file_handles[path].read(read_end - read_start)
+                except OSError:
+                    data = b''
+                complete = len(data) == read_end - read_start
+                piece_hash.update(data)
+            piece_hash.update(bytes(piece_end - hashed_until))
+            bitfield.append(1 if complete and piece_hash.digest() == pieces[piece_index * 20:piece_index * 20 + 20] else 0)
+    finally:
+        for file_handle in file_handles.values():
+            file_handle.close()
+    return bytes(bitfield)
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '{:.1f}'.format(size) + ' ' + unit
+        size = size / 1024
+    return '{:.1f}'.format(size) + ' TB'
+
+def verify_pieces(path, full_pieces):
+    try:
+        with open(path, 'rb') as file_handle, mmap.mmap(file_handle.fileno(), 0, access = mmap.ACCESS_READ) as file_map:
+            file_view = memoryview(file_map)
+            try:
+                for piece_start, piece_size, piece_hash in full_pieces:
+                    if hashlib.sha1(file_view[piece_start:piece_start + piece_size]).digest() != piece_hash:
+                        return False
+            finally:
+                file_view.release()
+    except (OSError, ValueError):
+        return False
+    return True
+
+def ask_user(question, options, ret_type = 'str', default = None):
+    options = list(map(str, options))
+    default = str(default)
+    q = question + ' (' 
+    for op in options:
+        if op == default:
+            q = q + '[' + op + ']/'
+        else:
+            q = q + op + '/'
+    q = q[:-1] + '): '
+    response = ''
+    while response.lower() not in options:
+        response = input(q) or default
+    if ret_type == 'int':
+        return int(response)
+    return response
+
+def line_separator():
+    print('-' * (shutil.get_terminal_size().columns - 1))
+
+def check_process_running(processName):
+    # Names are fetched with the process list, processes that vanish or deny access get None
+    psutil = import_dependency('psutil', 'psutil')
+    for proc in psutil.process_iter(['name']):
+        if processName.lower() in (proc.info['name'] or '').lower():
+            return True
+    return False
+
+def get_bt_backup_default():
+    if sys.platform == "win32":
+        return os.path.join(os.getenv('LOCALAPPDATA'), 'qBittorrent', 'BT_backup')
+    elif sys.platform == "linux":
+        return os.path.join(Path.home(), '.local', 'share', 'data', 'qBittorrent', 'BT_backup')
+    elif sys.platform == "darwin":
+        return os.path.join(Path.home(), 'Library', 'ApplicationSupport', 'qBittorrent', 'BT_backup')
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return import_dependency('psutil', 'psutil').Process().memory_info().peak_wset
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in KB everywhere else
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+def get_device_workers(device, workers):
+    # Spinning disks get a single worker, SSDs and network mounts get all of them
+    if sys.platform == "linux":
+        sysfs_path = os.path.join('/sys/dev/block', str(os.major(device)) + ':' + str(os.minor(device)))
+        for rotational_path in [os.path.join(sysfs_path, 'queue', 'rotational'), os.path.join(sysfs_path, '..', 'queue', 'rotational')]:
+            try:
+                with open(rotational_path, 'r') as file_handle:
+                    if file_handle.read().strip() == '1':
+                        return 1
+                    break
+            except OSError:
+                pass
+    return workers
+
+def get_journal_default(bt_backup):
+    # Next to the fastresume files so the originals can be hardlinked
+    return os.path.join(bt_backup, 'qbit_automatch_journal')
+
+def get_index_default():
+    if sys.platform == "win32":
+        cache_dir = os.getenv('LOCALAPPDATA')
+    elif sys.platform == "darwin":
+        cache_dir = os.path.join(Path.home(), 'Library', 'Caches')
+    else:
+        cache_dir = os.getenv('XDG_CACHE_HOME') or os.path.join(Path.home(), '.cache')
+    return os.path.join(cache_dir, 'qbit_automatch', 'index.sqlite')
@@ -0,0 +1,43 @@
+class QbitAutomatchError(Exception):
+    # Base of every error the library raises, the CLI prints them as FATAL
+    pass
+
+class MissingDependencyError(QbitAutomatchError):
+    pass
+
+class TorrentParseError(QbitAutomatchError):
+    def __init__(self, hash, message):
+        QbitAutomatchError.__init__(self, 'Could not parse torrent ' + hash + ': ' + message)
+        self.hash = hash
+
+class MatchError(QbitAutomatchError):
+    pass
+
+class UnmatchedFilesError(MatchError):
+    def __init__(self, paths):
+        QbitAutomatchError.__init__(self, 'This is script only works if all files are accounted for within the search_dir, ' + str(len(paths)) + ' files have no matches')
+        self.paths = paths
+
+class DuplicateMatchesError(MatchError):
+    pass
+
+class CancelledError(QbitAutomatchError):
+    pass
+
+class UnsupportedTorrentError(QbitAutomatchError):
+    pass
+
+class ProcessRunningError(QbitAutomatchError):
+    pass
+
+class WriteError(QbitAutomatchError):
+    pass
+
+class JournalError(QbitAutomatchError):
+    pass
+
+class MaterializeError(QbitAutomatchError):
+    pass
+
+class WebApiError(QbitAutomatchError):
+    pass
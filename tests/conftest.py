@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The package is used from the repo root, it isn't installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeQbittorrent:
+    # The part of the qBittorrent Web API used by WebApiClient, renames fail with 409 like
+    # qBittorrent when the new path is taken. fail_on makes one endpoint return 500
+    # fail_count times after fail_after successful calls
+    def __init__(self, torrents):
+        # hash -> {'name', 'save_path', 'files'}
+        self.torrents = torrents
+        self.requests = []
+        self.fail_on = None
+        self.fail_after = 0
+        self.fail_count = 1
+        self.lock = threading.Lock()
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                self.respond(*fake.handle(url.path, dict(urllib.parse.parse_qsl(url.query))))
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'] or 0)).decode('utf-8')
+                self.respond(*fake.handle(self.path, dict(urllib.parse.parse_qsl(body))))
+            def respond(self, status, data):
+                data = data if isinstance(data, bytes) else json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def handle(self, path, params):
+        endpoint = path[len('/api/v2/'):]
+        with self.lock:
+            self.requests.append((endpoint, params))
+            if endpoint == self.fail_on and self.fail_count:
+                if self.fail_after == 0:
+                    self.fail_count -= 1
+                    return 500, b'Injected failure'
+                self.fail_after -= 1
+            return getattr(self, endpoint.replace('/', '_'))(params)
+    def app_webapiVersion(self, params):
+        return 200, b'2.8.3'
+    def torrents_info(self, params):
+        hashes = params['hashes'].split('|') if 'hashes' in params else list(self.torrents)
+        return 200, [{'hash':x, 'name':self.torrents[x]['name'], 'save_path':self.torrents[x]['save_path']} for x in hashes if x in self.torrents]
+    def torrents_files(self, params):
+        return 200, [{'name':x, 'size':1} for x in self.torrents[params['hash']]['files']]
+    def torrents_setLocation(self, params):
+        self.torrents[params['hashes']]['save_path'] = params['location']
+        return 200, b''
+    def torrents_renameFile(self, params):
+        files = self.torrents[params['hash']]['files']
+        if params['oldPath'] not in files or params['newPath'] in files:
+            return 409, b'Conflict'
+        files[files.index(params['oldPath'])] = params['newPath']
+        return 200, b''
+    def torrents_renameFolder(self, params):
+        files = self.torrents[params['hash']]['files']
+        old_prefix = params['oldPath'] + '/'
+        new_prefix = params['newPath'] + '/'
+        if not any(x.startswith(old_prefix) for x in files) or any(x.startswith(new_prefix) for x in files):
+            return 409, b'Conflict'
+        files[:] = [new_prefix + x[len(old_prefix):] if x.startswith(old_prefix) else x for x in files]
+        return 200, b''
+    def torrents_recheck(self, params):
+        return 200, b''
@@ -0,0 +1,65 @@
+import random
+import bencode
+import pytest
+from qbit_automatch.core import BencodeReader, splice_bencoded_dict, get_dict_values
+
+FASTRESUME = {'file-format':'libtorrent resume file', 'info-hash':bytes(range(20)), 'pieces':b'\x01\x00' * 50, 'paused':0, 'qBt-savePath':'/old', 'save_path':'/old', 'peers':b'\xff' * 12, 'trackers':[['http://a/announce'], ['udp://b']]}
+
+def merged(data, updates):
+    return bencode.encode(dict(data, **updates))
+
+@pytest.mark.parametrize('updates', [
+    # replaced keys, shorter and longer
+    {'save_path':'/x', 'qBt-savePath':'/much/longer/new/path'},
+    {'paused':1},
+    # inserted before the first key, between keys and after the last one
+    {'a':1},
+    {'mapped_files':['a/b.mkv', '', 'c.srt']},
+    {'zzz':{'nested':[1, b'\x00\xff']}},
+    # replaced and inserted together, one of them already the same
+    {'save_path':'/old', 'mapped_files':['x'], 'paused':1, 'pieces':b'\x01' * 100},
+])
+def test_splice_matches_encoding_the_merged_dict(updates):
+    data = bencode.encode(FASTRESUME)
+    assert splice_bencoded_dict(data, updates) == merged(FASTRESUME, updates)
+
+def test_splice_without_changes():
+    data = bencode.encode(FASTRESUME)
+    assert splice_bencoded_dict(data, {}) is None
+    assert splice_bencoded_dict(data, {'save_path':'/old', 'paused':0, 'trackers':[['http://a/announce'], ['udp://b']]}) is None
+
+def test_splice_empty_dict():
+    assert splice_bencoded_dict(b'de', {'b':1, 'a':'x'}) == bencode.encode({'a':'x', 'b':1})
+
+def test_splice_copies_other_values_verbatim():
+    # An unsorted inner dict would be re-sorted by an encoder, the splice leaves it alone
+    data = b'd5:extrad1:bi1e1:ai2ee6:pausedi0ee'
+    assert splice_bencoded_dict(data, {'paused':1}) == b'd5:extrad1:bi1e1:ai2ee6:pausedi1ee'
+
+def random_value(rng, depth = 0):
+    kind = rng.randrange(5 if depth < 2 else 2)
+    if kind == 0:
+        return rng.randrange(-1000, 1000)
+    if kind == 1:
+        return bytes(rng.randrange(256) for x in range(rng.randrange(8)))
+    if kind == 2:
+        return rng.choice(['', 'path/ä.mkv', 'x' * 20])
+    if kind == 3:
+        return [random_value(rng, depth + 1) for x in range(rng.randrange(4))]
+    return dict((rng.choice('abcdef') * rng.randint(1, 3), random_value(rng, depth + 1)) for x in range(rng.randrange(4)))
+
+def test_splice_random_dicts():
+    rng = random.Random(0)
+    keys = ['a', 'b', 'mapped_files', 'paused', 'pieces', 'q', 'save_path', 'zz']
+    for x in range(300):
+        data = dict((key, random_value(rng)) for key in rng.sample(keys, rng.randrange(len(keys))))
+        updates = dict((key, random_value(rng)) for key in rng.sample(keys, rng.randrange(1, 4)))
+        expected = merged(data, updates)
+        result = splice_bencoded_dict(bencode.encode(data), updates)
+        assert (result or bencode.encode(data)) == expected
+        assert (result is None) == (expected == bencode.encode(data))
+
+def test_reader_decodes_like_bencode():
+    data = bencode.encode(FASTRESUME)
+    assert BencodeReader(data).decode(0) == (bencode.decode(data), len(data))
+    assert get_dict_values(data)[b'trackers'] == bencode.encode(FASTRESUME['trackers'])
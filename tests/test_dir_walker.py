@@ -0,0 +1,49 @@
+import os
+import pytest
+from qbit_automatch.core import SearchDir, PersistentIndex, FileInTorrent
+
+def make_file(path, size = 1):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as file_handle:
+        file_handle.write(b'x' * size)
+
+def get_candidates(search_dir, path, size = 1):
+    file_in_torrent = FileInTorrent(path, size)
+    search_dir.search_files([file_in_torrent])
+    return [x.path for x in file_in_torrent.matches]
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_nested_roots_are_listed_once(tmp_path, workers):
+    root = str(tmp_path)
+    make_file(os.path.join(root, 'y', 'renamed_b.mkv'))
+    make_file(os.path.join(root, 'x', 'renamed_a.mkv'), 2)
+    search_dir = SearchDir([root, os.path.join(root, 'y'), root], scan_workers = workers)
+    assert search_dir.files_count == 2
+    assert get_candidates(search_dir, 'b.mkv') == [os.path.join(root, 'y', 'renamed_b.mkv')]
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_nested_roots_are_indexed_once(tmp_path, workers):
+    root = str(tmp_path / 'library')
+    make_file(os.path.join(root, 'y', 'renamed_b.mkv'))
+    for x in range(2):
+        persistent_index = PersistentIndex(str(tmp_path / 'index.sqlite'))
+        try:
+            search_dir = SearchDir([root, os.path.join(root, 'y')], persistent_index = persistent_index, scan_workers = workers)
+        finally:
+            persistent_index.close()
+        assert get_candidates(search_dir, 'b.mkv') == [os.path.join(root, 'y', 'renamed_b.mkv')]
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_candidates_follow_os_walk_order(tmp_path, workers):
+    root = str(tmp_path / 'library')
+    for x in ['a/b/c', 'z', 'm/n', 'z/y/x/w', 'a']:
+        make_file(os.path.join(root, x, 'f.mkv'))
+    expected = [os.path.join(x[0], 'f.mkv') for x in os.walk(root) if 'f.mkv' in x[2]]
+    for x in range(5):
+        assert get_candidates(SearchDir([root], scan_workers = workers), 'f.mkv') == expected
+    persistent_index = PersistentIndex(str(tmp_path / 'index.sqlite'))
+    try:
+        for x in range(2):
+            assert get_candidates(SearchDir([root], persistent_index = persistent_index, scan_workers = workers), 'f.mkv') == expected
+    finally:
+        persistent_index.close()
@@ -0,0 +1,50 @@
+import os
+import stat
+from qbit_automatch.core import FastresumeWriter, write_atomic
+
+class PlannedFastresume:
+    # Stands in for a FastresumeFile, only what FastresumeWriter.stage reads
+    def __init__(self, fastresume_path, updated_data):
+        self.fastresume_path = fastresume_path
+        self.updated_data = updated_data
+    def read_updated(self):
+        with open(self.fastresume_path, 'rb') as file_handle:
+            return file_handle.read(), self.updated_data
+
+def make_fastresume(path, data, mode):
+    with open(path, 'wb') as file_handle:
+        file_handle.write(data)
+    os.chmod(path, mode)
+
+def get_mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_write_atomic_keeps_mode(tmp_path):
+    path = str(tmp_path / 'a.fastresume')
+    make_fastresume(path, b'old', 0o640)
+    write_atomic(path, b'new')
+    assert get_mode(path) == 0o640
+    with open(path, 'rb') as file_handle:
+        assert file_handle.read() == b'new'
+
+def test_commits_in_the_same_second(tmp_path):
+    journal_root = str(tmp_path / 'journal')
+    writer = FastresumeWriter(journal_root)
+    paths = [str(tmp_path / (x + '.fastresume')) for x in 'ab']
+    for path in paths:
+        make_fastresume(path, b'old', 0o644)
+    journal_paths = []
+    for path in paths:
+        writer.stage(PlannedFastresume(path, b'new'))
+        journal_paths.append(writer.commit(check_process = False))
+    assert len(set(journal_paths)) == 2
+    assert writer.get_latest_journal() == journal_paths[1]
+    # Rollbacks go from the latest batch back and restore the original mode
+    os.chmod(paths[1], 0o600)
+    writer.rollback(check_process = False)
+    assert get_mode(paths[1]) == 0o644
+    writer.rollback(check_process = False)
+    for path in paths:
+        with open(path, 'rb') as file_handle:
+            assert file_handle.read() == b'old'
+        assert get_mode(path) == 0o644
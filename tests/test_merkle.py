@@ -0,0 +1,114 @@
+import os
+import random
+import hashlib
+import bencode
+import pytest
+from qbit_automatch.core import TorrentFiles, FastresumeFile, FileInDisk, merkle_root, iter_block_hashes, verify_merkle_root, get_info_files, MERKLE_BLOCK_SIZE
+
+PIECE_LENGTH = 4 * MERKLE_BLOCK_SIZE
+HASH = 'b' * 40
+
+def reference_root(leaves, width, pad = bytes(32)):
+    # BEP 52 straight from the spec: pad the leaves to width, then hash pairs up to the root
+    nodes = list(leaves) + [pad] * (width - len(leaves))
+    while len(nodes) > 1:
+        nodes = [hashlib.sha256(nodes[x] + nodes[x + 1]).digest() for x in range(0, len(nodes), 2)]
+    return nodes[0]
+
+def next_power_of_two(value):
+    return 1 << (value - 1).bit_length()
+
+def get_reference(data):
+    # (pieces root, piece layer) of data, files up to one piece long have no piece layer
+    blocks = [hashlib.sha256(data[x:x + MERKLE_BLOCK_SIZE]).digest() for x in range(0, len(data), MERKLE_BLOCK_SIZE)]
+    if len(data) <= PIECE_LENGTH:
+        return reference_root(blocks, next_power_of_two(len(blocks))), None
+    blocks_per_piece = PIECE_LENGTH // MERKLE_BLOCK_SIZE
+    layer = [reference_root(blocks[x:x + blocks_per_piece], blocks_per_piece) for x in range(0, len(blocks), blocks_per_piece)]
+    piece_pad = reference_root([], blocks_per_piece)
+    return reference_root(layer, next_power_of_two(len(layer)), piece_pad), b''.join(layer)
+
+def make_data(size, seed = 0):
+    return random.Random(seed).randbytes(size) if hasattr(random.Random, 'randbytes') else bytes(random.Random(seed).getrandbits(8) for x in range(size))
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as file_handle:
+        file_handle.write(data)
+    return path
+
+SIZES = [1, MERKLE_BLOCK_SIZE - 1, MERKLE_BLOCK_SIZE, MERKLE_BLOCK_SIZE + 1, 3 * MERKLE_BLOCK_SIZE, PIECE_LENGTH, PIECE_LENGTH + 1, 5 * PIECE_LENGTH + 100, 8 * PIECE_LENGTH]
+
+@pytest.mark.parametrize('size', SIZES)
+def test_merkle_root_matches_reference(size):
+    data = make_data(size)
+    root, layer = get_reference(data)
+    assert merkle_root(iter_block_hashes(memoryview(data), 0, size), -(-size // MERKLE_BLOCK_SIZE)) == root
+    if layer is not None:
+        piece_pad = merkle_root([], PIECE_LENGTH // MERKLE_BLOCK_SIZE)
+        assert merkle_root([layer[x:x + 32] for x in range(0, len(layer), 32)], len(layer) // 32, piece_pad) == root
+
+@pytest.mark.parametrize('size', SIZES)
+def test_verify_merkle_root(tmp_path, size):
+    data = make_data(size)
+    root, layer = get_reference(data)
+    path = write_file(str(tmp_path / 'a.mkv'), data)
+    wrong_path = write_file(str(tmp_path / 'b.mkv'), data[:-1] + bytes([data[-1] ^ 1]))
+    assert verify_merkle_root(path, size, root, PIECE_LENGTH)
+    assert not verify_merkle_root(wrong_path, size, root, PIECE_LENGTH)
+    assert not verify_merkle_root(path, size + 1, root, PIECE_LENGTH)
+    if layer is not None:
+        assert verify_merkle_root(path, size, root, PIECE_LENGTH, layer)
+        assert not verify_merkle_root(wrong_path, size, root, PIECE_LENGTH, layer)
+        # The last piece is padded with zero blocks up to a full piece, not to a shorter tree
+        last_piece = data[(size - 1) // PIECE_LENGTH * PIECE_LENGTH:]
+        last_blocks = [hashlib.sha256(last_piece[x:x + MERKLE_BLOCK_SIZE]).digest() for x in range(0, len(last_piece), MERKLE_BLOCK_SIZE)]
+        short_layer = layer[:-32] + reference_root(last_blocks, next_power_of_two(len(last_blocks)))
+        assert verify_merkle_root(path, size, root, PIECE_LENGTH, short_layer) == (short_layer == layer)
+
+def make_v2_torrent(bt_backup, files, piece_layers = None):
+    # files are (name, data), the v2 file tree keeps them sorted like every bencoded dict
+    file_tree = {}
+    layers = {}
+    for name, data in files:
+        root, layer = get_reference(data)
+        file_tree[name] = {'':{'length':len(data), 'pieces root':root}}
+        if layer is not None:
+            layers[root] = layer
+    info = {'name':'Show', 'piece length':PIECE_LENGTH, 'meta version':2, 'file tree':file_tree}
+    write_file(os.path.join(bt_backup, HASH + '.torrent'), bencode.encode({'info':info, 'piece layers':piece_layers if piece_layers is not None else layers}))
+
+def test_v2_pad_files_in_mapped_files(tmp_path):
+    bt_backup = str(tmp_path / 'BT_backup')
+    files = [('a.mkv', make_data(100)), ('b.mkv', make_data(PIECE_LENGTH, 1)), ('c.srt', make_data(PIECE_LENGTH + 5, 2)), ('d.nfo', make_data(200, 3))]
+    make_v2_torrent(bt_backup, files)
+    torrent_files = TorrentFiles(bt_backup, HASH)
+    # libtorrent adds a pad file after a and c, b ends on a piece boundary and d is last
+    assert [(x.path, x.index, x.offset) for x in torrent_files.files] == [('a.mkv', 0, 0), ('b.mkv', 2, PIECE_LENGTH), ('c.srt', 3, 2 * PIECE_LENGTH), ('d.nfo', 5, 4 * PIECE_LENGTH)]
+    assert torrent_files.storage_files_count == 6
+    assert torrent_files.total_size == 4 * PIECE_LENGTH + 200
+    for file_in_torrent in torrent_files.files:
+        file_in_torrent.set_single_match(FileInDisk(path = str(tmp_path / 'library' / 'renamed' / file_in_torrent.path), size = file_in_torrent.size))
+    fastresume_file = FastresumeFile(bt_backup, HASH, torrent_files)
+    assert fastresume_file.save_path == str(tmp_path / 'library')
+    assert fastresume_file.mapped_files == [os.path.join('renamed', 'a.mkv'), '', os.path.join('renamed', 'b.mkv'), os.path.join('renamed', 'c.srt'), '', os.path.join('renamed', 'd.nfo')]
+
+def test_get_info_files_single_v2_file():
+    files, storage_files_count, total_size = get_info_files({'piece length':PIECE_LENGTH, 'file tree':[{'path':['a.mkv'], 'length':100, 'pieces root':b'r' * 32}]})
+    assert [(x.path, x.index, x.pieces_root) for x in files] == [('a.mkv', 0, b'r' * 32)]
+    assert (storage_files_count, total_size) == (1, 100)
+
+@pytest.mark.parametrize('bad_layer', [False, True])
+def test_verify_merkle_roots_keeps_matching_candidates(tmp_path, bad_layer):
+    bt_backup = str(tmp_path / 'BT_backup')
+    data = make_data(3 * PIECE_LENGTH + 7)
+    root, layer = get_reference(data)
+    # A piece layer that doesn't add up to the root is ignored and the whole file is hashed
+    make_v2_torrent(bt_backup, [('a.mkv', data)], {root:bytes(len(layer))} if bad_layer else None)
+    right_path = write_file(str(tmp_path / 'library' / 'x' / 'a.mkv'), data)
+    wrong_path = write_file(str(tmp_path / 'library' / 'y' / 'a.mkv'), data[::-1])
+    torrent_files = TorrentFiles(bt_backup, HASH)
+    file_in_torrent = torrent_files.files[0]
+    file_in_torrent.matches.extend([FileInDisk(path = wrong_path, size = len(data)), FileInDisk(path = right_path, size = len(data))])
+    torrent_files.verify_merkle_roots()
+    assert [x.path for x in file_in_torrent.matches] == [right_path]
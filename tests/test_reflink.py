@@ -0,0 +1,21 @@
+import os
+import errno
+import pytest
+from qbit_automatch.core import reflink_file
+
+def test_reflink_keeps_mode(tmp_path):
+    path = str(tmp_path / 'a.mkv')
+    with open(path, 'wb') as file_handle:
+        file_handle.write(b'x' * 4096)
+    os.chmod(path, 0o644)
+    link_path = str(tmp_path / 'b.mkv')
+    try:
+        reflink_file(path, link_path)
+    except OSError as e:
+        if e.errno in [errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV]:
+            pytest.skip('No reflinks on this filesystem: ' + str(e))
+        raise
+    stat = os.stat(link_path)
+    assert stat.st_mode & 0o7777 == 0o644
+    assert (stat.st_uid, stat.st_gid) == (os.stat(path).st_uid, os.stat(path).st_gid)
+    assert [x.name for x in tmp_path.iterdir() if x.name.endswith('.tmp')] == []
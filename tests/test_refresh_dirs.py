@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+from qbit_automatch.core import SearchDir, PollingWatcher
+
+def make_file(path, size = 1):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as file_handle:
+        file_handle.write(b'x' * size)
+
+def wait_mtime_tick():
+    # Directory mtimes are coarse on some filesystems, a change in the same tick isn't seen
+    time.sleep(0.05)
+
+def get_paths(search_dir):
+    return sorted(search_dir.get_file(x).path for x in range(len(search_dir.file_sizes)) if x not in search_dir.deleted_rows)
+
+def refresh(search_dir, watcher):
+    wait_mtime_tick()
+    added, removed = search_dir.refresh_dirs(watcher.read_events(0), watcher.watch)
+    for path in removed:
+        watcher.unwatch(path)
+    return added, removed
+
+def create_search_dir(root):
+    make_file(os.path.join(root, 'old', 'a.mkv'))
+    search_dir = SearchDir([root], scan_workers = 1)
+    watcher = PollingWatcher()
+    for path in search_dir.listed_dirs:
+        watcher.watch(path)
+    wait_mtime_tick()
+    return search_dir, watcher
+
+def test_new_dir(tmp_path):
+    root = str(tmp_path)
+    search_dir, watcher = create_search_dir(root)
+    make_file(os.path.join(root, 'new', 'b.mkv'), 2)
+    added, removed = refresh(search_dir, watcher)
+    assert added == [os.path.join(root, 'new')]
+    assert removed == []
+    assert get_paths(search_dir) == [os.path.join(root, 'new', 'b.mkv'), os.path.join(root, 'old', 'a.mkv')]
+    assert search_dir.total_size == 3
+
+def test_nested_dirs_are_watched(tmp_path):
+    root = str(tmp_path)
+    search_dir, watcher = create_search_dir(root)
+    make_file(os.path.join(root, 'a', 'b', 'c', 'c.mkv'))
+    make_file(os.path.join(root, 'a', 'b', 'b.mkv'))
+    added, removed = refresh(search_dir, watcher)
+    assert sorted(added) == [os.path.join(root, 'a'), os.path.join(root, 'a', 'b'), os.path.join(root, 'a', 'b', 'c')]
+    assert all(x in watcher.mtimes for x in added)
+    assert search_dir.files_count == 3
+    # Files created after the refresh are seen through the watches it added
+    wait_mtime_tick()
+    make_file(os.path.join(root, 'a', 'b', 'c', 'd.mkv'))
+    refresh(search_dir, watcher)
+    assert os.path.join(root, 'a', 'b', 'c', 'd.mkv') in get_paths(search_dir)
+
+def test_dirs_are_watched_before_listing(tmp_path):
+    root = str(tmp_path)
+    search_dir, watcher = create_search_dir(root)
+    os.makedirs(os.path.join(root, 'a'))
+    def watch(path):
+        watcher.watch(path)
+        # Created between the watch and the listing, like a mkdir -p still running
+        if path == os.path.join(root, 'a'):
+            make_file(os.path.join(root, 'a', 'b', 'b.mkv'))
+    wait_mtime_tick()
+    added, removed = search_dir.refresh_dirs(watcher.read_events(0), watch)
+    assert sorted(added) == [os.path.join(root, 'a'), os.path.join(root, 'a', 'b')]
+    assert os.path.join(root, 'a', 'b', 'b.mkv') in get_paths(search_dir)
+
+def test_removed_dirs(tmp_path):
+    root = str(tmp_path)
+    make_file(os.path.join(root, 'a', 'b', 'b.mkv'))
+    search_dir, watcher = create_search_dir(root)
+    shutil.rmtree(os.path.join(root, 'a'))
+    added, removed = refresh(search_dir, watcher)
+    assert added == []
+    assert sorted(removed) == [os.path.join(root, 'a'), os.path.join(root, 'a', 'b')]
+    assert get_paths(search_dir) == [os.path.join(root, 'old', 'a.mkv')]
+    assert os.path.join(root, 'a') not in watcher.mtimes
+    assert os.path.join(root, 'a') not in search_dir.listed_dirs
@@ -0,0 +1,27 @@
+from qbit_automatch.core import ReverseIndex
+
+def make_info(name, files):
+    return {'name':name, 'piece length':16384, 'files':[{'path':[x[0]], 'length':x[1]} for x in files]}
+
+def create_index():
+    reverse_index = ReverseIndex()
+    reverse_index.add_torrent('a', make_info('A', [('e01.srt', 100), ('e02.srt', 100), ('e01.mkv', 5000)]))
+    reverse_index.add_torrent('b', make_info('B', [('other.srt', 100)]))
+    reverse_index.build()
+    return reverse_index
+
+def test_same_key_files_need_their_own_library_files():
+    reverse_index = create_index()
+    reverse_index.add_files([('/lib/x.srt', 100), ('/lib/x.mkv', 5000)])
+    assert reverse_index.pop_complete() == [1]
+    assert reverse_index.get_ranking() == [(0, 2, 5100), (1, 1, 100)]
+    reverse_index.add_files([('/lib/y.srt', 100)])
+    assert reverse_index.pop_complete() == [0]
+    assert reverse_index.get_ranking()[0] == (0, 3, 5200)
+
+def test_unmatched_files_cover_nothing():
+    reverse_index = create_index()
+    reverse_index.add_files([('/lib/x.srt', 101), ('/lib/x.nfo', 100)])
+    assert reverse_index.pop_complete() == []
+    assert reverse_index.get_ranking() == []
+    assert reverse_index.library_files_count == 2
@@ -0,0 +1,31 @@
+import random
+import itertools
+import pytest
+from qbit_automatch.core import solve_assignment, NO_EDGE
+
+def brute_force(cost):
+    return min(sum(cost[row][column] for row, column in enumerate(columns)) for columns in itertools.permutations(range(len(cost[0])), len(cost)))
+
+def check(cost):
+    solution = solve_assignment(cost)
+    assert len(set(solution)) == len(cost)
+    assert all(column is not None and 0 <= column < len(cost[0]) for column in solution)
+    assert sum(cost[row][column] for row, column in enumerate(solution)) == brute_force(cost)
+
+@pytest.mark.parametrize('seed', range(200))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    rows_count = rng.randint(1, 5)
+    columns_count = rng.randint(rows_count, 6)
+    # Small values so ties are common, some pairs aren't candidates at all
+    check([[NO_EDGE if rng.random() < 0.2 else rng.randrange(4) for x in range(columns_count)] for x in range(rows_count)])
+
+def test_float_costs():
+    rng = random.Random(1)
+    for x in range(50):
+        check([[rng.random() * 30 for x in range(4)] for x in range(4)])
+
+def test_collision_is_resolved():
+    # Both rows prefer column 0, the cheaper total gives it to row 1
+    assert solve_assignment([[1, 3], [0, 10]]) == [1, 0]
+    assert solve_assignment([[5]]) == [0]
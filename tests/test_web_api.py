@@ -0,0 +1,86 @@
+import pytest
+from fake_qbittorrent import FakeQbittorrent
+from qbit_automatch.core import WebApiClient, plan_renames
+from qbit_automatch.errors import WebApiError
+
+HASH = 'a' * 40
+
+@pytest.fixture
+def fake():
+    fake = FakeQbittorrent({HASH:{'name':'Show', 'save_path':'/old', 'files':[]}})
+    yield fake
+    fake.close()
+
+def relocate(fake, files, save_path, mapped_files):
+    fake.torrents[HASH]['files'] = list(files)
+    web_api = WebApiClient(fake.url, workers = 4)
+    try:
+        web_api.login()
+        return web_api.relocate(HASH, save_path, mapped_files)
+    finally:
+        web_api.close()
+
+def get_renames(fake, endpoint):
+    return [(x[1]['oldPath'], x[1]['newPath']) for x in fake.requests if x[0] == endpoint]
+
+def test_plan_renames_collapses_folders():
+    current_paths = ['Show/S1/a.mkv', 'Show/S1/b.mkv', 'Show/S2/c.mkv', 'Show/d.nfo']
+    target_paths = ['Renamed/Season 1/a.mkv', 'Renamed/Season 1/b.mkv', 'Renamed/S2/c.mkv', 'Renamed/info.nfo']
+    folder_renames, file_waves = plan_renames(current_paths, target_paths)
+    assert folder_renames == [('Show/S1', 'Renamed/Season 1'), ('Show/S2', 'Renamed/S2')]
+    assert file_waves == [[('Show/d.nfo', 'Renamed/info.nfo')]]
+
+def test_plan_renames_orders_chains():
+    folder_renames, file_waves = plan_renames(['a', 'b', 'c'], ['b', 'c', 'd'])
+    assert folder_renames == []
+    assert file_waves == [[('c', 'd')], [('b', 'c')], [('a', 'b')]]
+
+def test_plan_renames_breaks_swaps():
+    folder_renames, file_waves = plan_renames(['x/a', 'x/b', 'x/c'], ['x/b', 'x/a', 'x/d'])
+    renames = [x for wave in file_waves for x in wave]
+    files = ['x/a', 'x/b', 'x/c']
+    for old_path, new_path in renames:
+        assert new_path not in files
+        files[files.index(old_path)] = new_path
+    assert files == ['x/b', 'x/a', 'x/d']
+    assert len(renames) == 4
+
+def test_relocate_folder_collapse(fake):
+    files = ['Show/S1/a.mkv', 'Show/S1/b.mkv', 'Show/c.nfo']
+    assert relocate(fake, files, '/new', ['Renamed/S1/a.mkv', 'Renamed/S1/b.mkv', 'Renamed/c.nfo'])
+    assert fake.torrents[HASH] == {'name':'Show', 'save_path':'/new', 'files':['Renamed/S1/a.mkv', 'Renamed/S1/b.mkv', 'Renamed/c.nfo']}
+    assert get_renames(fake, 'torrents/renameFolder') == [('Show', 'Renamed')]
+    assert get_renames(fake, 'torrents/renameFile') == []
+    assert fake.requests[-1][0] == 'torrents/recheck'
+
+def test_relocate_chain_and_swap(fake):
+    files = ['Show/1.mkv', 'Show/2.mkv', 'Show/3.mkv', 'Show/a.srt', 'Show/b.srt']
+    targets = ['Show/2.mkv', 'Show/3.mkv', 'Show/4.mkv', 'Show/b.srt', 'Show/a.srt']
+    assert relocate(fake, files, '/old', targets)
+    assert fake.torrents[HASH]['files'] == targets
+    assert not any(x[0] == 'torrents/setLocation' for x in fake.requests)
+
+def test_relocate_skips_pad_files(fake):
+    # mapped_files built from a hybrid .torrent has empty paths for pad files
+    assert relocate(fake, ['Show/a.mkv', 'Show/b.mkv'], '/old', ['x/a.mkv', '', 'x/b.mkv', ''])
+    assert fake.torrents[HASH]['files'] == ['x/a.mkv', 'x/b.mkv']
+
+def test_relocate_unchanged(fake):
+    assert not relocate(fake, ['Show/a.mkv'], '/old', ['Show/a.mkv'])
+    assert [x[0] for x in fake.requests] == ['app/webapiVersion', 'torrents/info', 'torrents/files']
+
+def test_relocate_undoes_partial_relocation(fake):
+    files = ['Show/1.mkv', 'Show/2.mkv', 'Show/3.mkv', 'Show/a.srt', 'Show/b.srt']
+    fake.fail_on = 'torrents/renameFile'
+    fake.fail_after = 2
+    with pytest.raises(WebApiError, match = 'undone'):
+        relocate(fake, files, '/new', ['Show/2.mkv', 'Show/3.mkv', 'Show/4.mkv', 'Show/b.srt', 'Show/a.srt'])
+    assert fake.torrents[HASH] == {'name':'Show', 'save_path':'/old', 'files':files}
+    assert not any(x[0] == 'torrents/recheck' for x in fake.requests)
+
+def test_relocate_reports_failed_undo(fake):
+    fake.fail_on = 'torrents/renameFolder'
+    fake.fail_after = 1
+    fake.fail_count = 2
+    with pytest.raises(WebApiError, match = 'partly relocated'):
+        relocate(fake, ['Show/S1/a.mkv', 'Show/S2/b.mkv'], '/new', ['A/a.mkv', 'B/b.mkv'])